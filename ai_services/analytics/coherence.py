@@ -0,0 +1,119 @@
+""" Contrôles de cohérence croisés entre les documents d'un même dossier client """
+from typing import Dict, List, Optional
+
+from ai_services.ocr.pages import normalize_text, parse_date
+
+
+# =========================
+# NORMALISATION
+# =========================
+
+NATIONALITE_CIV = ("IVOIR", "COTE D IVOIRE", "CIV")
+
+
+def normalize_name(nom, prenoms) -> Optional[frozenset]:
+    """
+    Nom complet sous forme d'ensemble de mots normalisés (ordre et accents ignorés).
+    """
+    tokens = set()
+    for part in (nom, prenoms):
+        norm = normalize_text(part)
+        if norm:
+            tokens.update(norm.split())
+    return frozenset(tokens) or None
+
+
+def normalize_date(value) -> Optional[str]:
+    date = parse_date(value)
+    return date.strftime("%d/%m/%Y") if date else None
+
+
+def normalize_nationality(value) -> Optional[str]:
+    norm = normalize_text(value)
+    if norm is None:
+        return None
+    if any(token in norm for token in NATIONALITE_CIV):
+        return "CIV"
+    return norm
+
+
+# =========================
+# CONTRÔLES
+# =========================
+
+def _compare(values: Dict[str, object], partial_match=None) -> Dict:
+    """
+    values : {libellé du document: valeur normalisée ou None}
+    Statut : "coherent", "partiel" (noms inclus l'un dans l'autre),
+    "incoherent" ou "insuffisant" (moins de deux documents renseignés).
+    """
+    present = {k: v for k, v in values.items() if v is not None}
+    if len(present) < 2:
+        status = "insuffisant"
+    elif len(set(present.values())) == 1:
+        status = "coherent"
+    elif partial_match is not None and partial_match(list(present.values())):
+        status = "partiel"
+    else:
+        status = "incoherent"
+    return {"statut": status, "valeurs": {k: (sorted(v) if isinstance(v, frozenset) else v) for k, v in present.items()}}
+
+
+def _names_nested(names: List[frozenset]) -> bool:
+    # Un prénom manquant sur un document : l'un des noms est inclus dans l'autre
+    shortest = min(names, key=len)
+    return len(shortest) >= 2 and all(shortest <= n for n in names)
+
+
+def check_dossier_consistency(documents: List[Dict]) -> Dict:
+    """
+    Compare nom, date de naissance et nationalité entre les documents
+    d'identité d'un dossier. Les extraits RCCM ne portent pas ces champs :
+    on vérifie à la place que le titulaire figure parmi leurs dirigeants.
+
+    documents : [{"libelle": str, "type_document": str, "info": dict}, ...]
+    """
+    names, births, nationalities = {}, {}, {}
+    rccm_docs = []
+
+    for doc in documents:
+        info = doc.get("info") or {}
+        label = doc["libelle"]
+        if "RCCM" in (doc.get("type_document") or ""):
+            rccm_docs.append(doc)
+            continue
+        names[label] = normalize_name(info.get("nom"), info.get("prenoms"))
+        births[label] = normalize_date(info.get("date_naissance"))
+        nationalities[label] = normalize_nationality(info.get("nationalite"))
+
+    checks = {
+        "nom": _compare(names, partial_match=_names_nested),
+        "date_naissance": _compare(births),
+        "nationalite": _compare(nationalities),
+    }
+
+    identities = [n for n in names.values() if n]
+    for doc in rccm_docs:
+        managers = [normalize_name(d.get("nom"), None) for d in (doc.get("info") or {}).get("dirigeants") or []]
+        managers = [m for m in managers if m]
+        if not identities or not managers:
+            status = "insuffisant"
+        elif any(m <= ident or ident <= m for m in managers for ident in identities):
+            status = "coherent"
+        else:
+            status = "incoherent"
+        checks[f"dirigeant_{doc['libelle']}"] = {"statut": status, "valeurs": {doc["libelle"]: [sorted(m) for m in managers]}}
+
+    return checks
+
+
+def compute_dossier_score(documents: List[Dict], checks: Dict) -> Optional[int]:
+    """
+    Score du dossier : plus faible score documentaire, moins 25 points par
+    contrôle croisé incohérent.
+    """
+    scores = [d["score"] for d in documents if isinstance(d.get("score"), (int, float))]
+    if not scores:
+        return None
+    penalty = 25 * sum(1 for c in checks.values() if c["statut"] == "incoherent")
+    return max(0, min(100, int(min(scores)) - penalty))
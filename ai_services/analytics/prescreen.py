@@ -0,0 +1,362 @@
+""" Pré-contrôle forensique local (sans LLM) des pages de documents """
+import io
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+from PIL import Image
+
+
+# =========================
+# SEUILS DU PRÉ-CONTRÔLE
+# =========================
+# Heuristiques volontairement conservatrices : seul un rejet "évident"
+# court-circuite l'appel au modèle, le reste est remonté comme signal.
+
+PRESCREEN_MIN_SIDE = 300                 # px, en dessous : illisible
+PRESCREEN_MAX_ASPECT = 3.0               # long côté / petit côté
+PRESCREEN_ASPECT_RANGE = (1.2, 1.9)      # ID-1 (1.59), passeport (1.42), A4 (1.41), photo 4:3 / 16:9
+PRESCREEN_MIN_STD = 6.0                  # écart-type des niveaux de gris : contraste faible (signal)
+PRESCREEN_MIN_EDGE_DENSITY = 0.004       # part de pixels de contour : peu de texte (signal)
+PRESCREEN_BLANK_STD = 1.0                # en dessous des deux seuils : page vide / uniforme (rejet)
+PRESCREEN_BLANK_EDGE_DENSITY = 0.0002
+PRESCREEN_ELA_QUALITY = 90              # une source de qualité estimée supérieure n'est pas évaluée par ELA
+PRESCREEN_ELA_WINDOW = 512               # fenêtre centrale (alignée sur la grille JPEG 8x8)
+PRESCREEN_ELA_BLOCK = 32
+PRESCREEN_ELA_MAX_BLOCK_RATIO = 6.0      # bloc le plus "chaud" / bloc médian
+PRESCREEN_ANALYSIS_SIDE = 512            # px, côté max de l'image de travail (hors ELA)
+PRESCREEN_MOIRE_SIZE = 256
+PRESCREEN_MOIRE_PEAK_RATIO = 60.0        # pic spectral / médiane de la bande moyenne fréquence (chroma)
+PRESCREEN_MOIRE_MIN_CHROMA_DOMINANCE = 8.0   # pic chroma / pic luminance à la même fréquence
+PRESCREEN_REJECT_SCORE = 1.0
+
+EDITING_SOFTWARE = (
+    "photoshop", "gimp", "lightroom", "snapseed", "picsart",
+    "canva", "pixlr", "affinity", "paint.net", "facetune",
+)
+
+# Résolutions d'écran courantes (largeur, hauteur) pour les captures d'écran
+SCREEN_RESOLUTIONS = {
+    (1280, 720), (1366, 768), (1440, 900), (1536, 864), (1600, 900),
+    (1920, 1080), (1920, 1200), (2560, 1440), (2560, 1600), (3840, 2160),
+    (750, 1334), (828, 1792), (1080, 1920), (1080, 2340), (1080, 2400),
+    (1170, 2532), (1179, 2556), (1284, 2778), (1290, 2796), (1440, 3200),
+}
+
+SOFT_SIGNAL_WEIGHTS = {
+    "logiciel_edition": 0.6,
+    "capture_ecran": 0.6,
+    "moire_ecran": 0.3,                  # faible tant que non calibré sur des recto/verso réels
+    "ela_localisee": 0.3,
+    "aspect_atypique": 0.2,
+    "contenu_faible": 0.3,               # scan pâle ou peu contrasté : le modèle peut encore le lire
+}
+
+
+# Table de quantification luminance de référence (IJG, qualité 50), pour estimer la qualité d'un JPEG
+_IJG_LUMA_TABLE_MEAN = float(np.mean([
+    16, 11, 10, 16, 24, 40, 51, 61, 12, 12, 14, 19, 26, 58, 60, 55,
+    14, 13, 16, 24, 40, 57, 69, 56, 14, 17, 22, 29, 51, 87, 80, 62,
+    18, 22, 37, 56, 68, 109, 103, 77, 24, 35, 55, 64, 81, 104, 113, 92,
+    49, 64, 78, 87, 103, 121, 120, 101, 72, 92, 95, 98, 112, 100, 103, 99,
+]))
+
+
+# =========================
+# SIGNAUX ÉLÉMENTAIRES
+# =========================
+
+def _working_copy(img: Image.Image) -> Image.Image:
+    """
+    Copie réduite de la page pour les signaux globaux (contenu, moiré) :
+    leur coût ne dépend plus de la résolution source.
+    """
+    factor = -(-max(img.size) // PRESCREEN_ANALYSIS_SIDE)
+    return img.reduce(factor) if factor > 1 else img
+
+
+def geometry_signals(img: Image.Image) -> Dict:
+    """
+    Résolution et ratio d'aspect de la page.
+    """
+    w, h = img.size
+    short_side, long_side = min(w, h), max(w, h)
+    return {
+        "largeur": w,
+        "hauteur": h,
+        "ratio_aspect": round(long_side / short_side, 3) if short_side else None,
+    }
+
+
+def content_signals(gray: np.ndarray) -> Dict:
+    """
+    Dispersion des niveaux de gris et densité de contours : une page sans
+    contraste ni contours n'est pas un document.
+    """
+    gx = np.abs(np.diff(gray, axis=1))
+    gy = np.abs(np.diff(gray, axis=0))
+    edges = (gx[:-1, :] + gy[:, :-1]) > 40.0
+    return {
+        "ecart_type_gris": round(float(gray.std()), 2),
+        "densite_contours": round(float(edges.mean()), 4),
+    }
+
+
+def _jpeg_quality(src: Image.Image) -> Optional[int]:
+    """
+    Qualité JPEG estimée (échelle IJG) à partir de la table de quantification luminance.
+    """
+    tables = getattr(src, "quantization", None) or {}
+    if 0 not in tables:
+        return None
+    scale = float(np.mean(tables[0])) / _IJG_LUMA_TABLE_MEAN * 100
+    quality = (200 - scale) / 2 if scale <= 100 else 5000 / scale
+    return int(round(min(100.0, max(1.0, quality))))
+
+
+def exif_signals(source_bytes: bytes) -> Dict:
+    """
+    Format source, logiciel déclaré dans l'EXIF (tag Software), présence
+    d'informations d'appareil photo (Make / Model) et qualité JPEG estimée.
+    """
+    src = Image.open(io.BytesIO(source_bytes))
+    exif = src.getexif()
+    software = str(exif.get(0x0131) or "").strip()
+    return {
+        "format": src.format,
+        "logiciel": software or None,
+        "appareil_photo": bool(exif.get(0x010F) or exif.get(0x0110)),
+        "taille_source": src.size,
+        "jpeg_qualite": _jpeg_quality(src) if src.format == "JPEG" else None,
+    }
+
+
+def error_level_analysis(img: Image.Image) -> Dict:
+    """
+    Error Level Analysis sur une fenêtre centrale non ré-échantillonnée :
+    on recompresse en JPEG et on mesure l'écart par blocs. Une zone collée
+    ou retouchée ressort avec une erreur très supérieure au reste de la page.
+    """
+    w, h = img.size
+    win = PRESCREEN_ELA_WINDOW
+    left = max(0, (w - win) // 2) // 8 * 8
+    top = max(0, (h - win) // 2) // 8 * 8
+    crop = img.crop((left, top, min(w, left + win), min(h, top + win)))
+
+    buf = io.BytesIO()
+    crop.save(buf, format="JPEG", quality=PRESCREEN_ELA_QUALITY)
+    recompressed = Image.open(buf).convert("RGB")
+
+    a = np.asarray(crop)
+    b = np.asarray(recompressed)
+    delta = np.maximum(a, b) - np.minimum(a, b)             # |a - b| sans conversion hors uint8
+    # maximum par canal sans réduction sur l'axe de longueur 3 (lente, non contiguë)
+    diff = np.maximum(np.maximum(delta[..., 0], delta[..., 1]), delta[..., 2]).astype(np.float32)
+
+    bs = PRESCREEN_ELA_BLOCK
+    bh, bw = diff.shape[0] // bs, diff.shape[1] // bs
+    if bh == 0 or bw == 0:
+        return {"ela_moyenne": round(float(diff.mean()), 3), "ela_ratio_blocs": None}
+
+    blocks = diff[:bh * bs, :bw * bs].reshape(bh, bs, bw, bs).mean(axis=(1, 3))
+    median = float(np.median(blocks))
+    return {
+        "ela_moyenne": round(float(diff.mean()), 3),
+        "ela_ratio_blocs": round(float(blocks.max()) / max(median, 0.5), 2),
+    }
+
+
+def _moire_band(n: int) -> np.ndarray:
+    """
+    Bande moyenne fréquence hors axes, sur le demi-plan du spectre rfft2 :
+    le spectre d'un signal réel étant symétrique, chaque paire n'y figure qu'une fois.
+    """
+    yy, xx = np.meshgrid(np.fft.fftfreq(n) * n, np.arange(n // 2 + 1), indexing="ij")
+    radius = np.hypot(xx, yy)
+    return (radius > n * 0.08) & (radius < n * 0.45) & (np.abs(xx) > 2) & (np.abs(yy) > 2)
+
+
+_MOIRE_BAND = _moire_band(PRESCREEN_MOIRE_SIZE)
+
+
+def moire_signals(img: Image.Image) -> Dict:
+    """
+    Détection du moiré d'écran : une photo d'écran présente des franges
+    colorées périodiques (sous-pixels RGB), soit des pics isolés en moyenne
+    fréquence dans le spectre 2D de la chrominance, hors des axes (grille JPEG).
+
+    Un document imprimé en couleur à mise en page régulière (texte bleu sur
+    fond beige, fonds guillochés) produit aussi des pics de chroma, mais la
+    même périodicité y existe en luminance. Le moiré n'est retenu que si le
+    pic est dominé par la chroma : rapport chroma / luminance à la même
+    fréquence (moire_dominance_chroma).
+    """
+    n = PRESCREEN_MOIRE_SIZE
+    ycbcr = np.asarray(img.resize((n, n), Image.BILINEAR).convert("YCbCr"), dtype=np.float32)
+
+    def band_spectrum(channel: np.ndarray) -> np.ndarray:
+        return np.abs(np.fft.rfft2(channel - channel.mean())[_MOIRE_BAND])
+
+    chroma = band_spectrum(ycbcr[..., 1] + ycbcr[..., 2])
+    luma = band_spectrum(ycbcr[..., 0])
+
+    chroma_ratio = chroma / max(float(np.median(chroma)), 1e-6)
+    luma_ratio = luma / max(float(np.median(luma)), 1e-6)
+    peak = int(np.argmax(chroma_ratio))
+    return {
+        "moire_ratio_pic": round(float(chroma_ratio[peak]), 2),
+        "moire_dominance_chroma": round(float(chroma_ratio[peak]) / max(float(luma_ratio[peak]), 1.0), 2),
+    }
+
+
+# =========================
+# PRÉ-CONTRÔLE D'UNE PAGE
+# =========================
+
+def prescreen_page(img: Image.Image, source_bytes: Optional[bytes] = None,
+                   resolution_scale: float = 1.0, ela: bool = True,
+                   original: Optional[Image.Image] = None) -> Dict:
+    """
+    Pré-contrôle vectorisé (NumPy) d'une page : quelques millisecondes sur
+    l'image réduite du premier passage, quelle que soit la résolution source
+    (ELA et EXIF compris).
+
+    - img              : page RGB telle qu'envoyée au premier passage (déjà réduite),
+                         pour les signaux de contenu et de moiré.
+    - source_bytes     : fichier image d'origine (None pour une page rendue depuis un PDF),
+                         nécessaire pour l'EXIF et l'ELA.
+    - original         : page pleine résolution décodée depuis source_bytes (défaut : img),
+                         pour la géométrie et la fenêtre ELA, qui ne doit pas être ré-échantillonnée.
+    - resolution_scale : rapport entre l'échelle d'analyse et celle de `img`. Une page
+                         PDF pré-contrôlée sur son rendu basse résolution serait sinon
+                         jugée illisible alors que le modèle la recevra à pdf_scale.
+    - ela              : False si la source a été ré-encodée avant l'envoi (pré-compression
+                         navigateur) : l'ELA n'y mesure plus que ce ré-encodage uniforme
+                         et est marquée "non_applicable".
+
+    Retourne un dict {verdict, motifs, score_suspicion, signaux, temps_ms}
+    avec verdict = "rejet" | "suspect" | "ok".
+    """
+    start_time = time.perf_counter()
+    signals: Dict = {}
+    hard: List[str] = []
+    soft: List[str] = []
+    original = original if original is not None else img
+
+    # 1) Résolution et ratio d'aspect
+    signals.update(geometry_signals(original))
+    signals["resolution_analyse"] = int(min(original.size) * resolution_scale)
+    if signals["resolution_analyse"] < PRESCREEN_MIN_SIDE:
+        hard.append("resolution_insuffisante")
+    ratio = signals["ratio_aspect"]
+    if ratio is not None and ratio > PRESCREEN_MAX_ASPECT:
+        hard.append("ratio_aspect_extreme")
+    elif ratio is not None and not (PRESCREEN_ASPECT_RANGE[0] <= ratio <= PRESCREEN_ASPECT_RANGE[1]):
+        soft.append("aspect_atypique")
+
+    # 2) Contenu : seule une page vide / uniforme est rejetée, un scan pâle n'est que signalé
+    work = _working_copy(img)
+    gray = np.asarray(work.convert("L"), dtype=np.float32)
+    signals.update(content_signals(gray))
+    std, edge_density = signals["ecart_type_gris"], signals["densite_contours"]
+    if std < PRESCREEN_BLANK_STD and edge_density < PRESCREEN_BLANK_EDGE_DENSITY:
+        hard.append("non_document")
+    elif std < PRESCREEN_MIN_STD or edge_density < PRESCREEN_MIN_EDGE_DENSITY:
+        soft.append("contenu_faible")
+
+    # 3) EXIF / logiciel / capture d'écran
+    if source_bytes is not None:
+        exif = exif_signals(source_bytes)
+        signals.update(exif)
+        software = (exif["logiciel"] or "").lower()
+        if any(name in software for name in EDITING_SOFTWARE):
+            soft.append("logiciel_edition")
+        w, h = exif["taille_source"]
+        if exif["format"] == "PNG" and not exif["appareil_photo"] and ((w, h) in SCREEN_RESOLUTIONS or (h, w) in SCREEN_RESOLUTIONS):
+            soft.append("capture_ecran")
+
+        # 4) ELA : uniquement pertinent sur une source JPEG d'origine, de qualité au plus
+        # celle de la recompression (au-delà, les contours nets du texte ressortent seuls)
+        quality = exif["jpeg_qualite"]
+        if exif["format"] == "JPEG" and (not ela or (quality is not None and quality > PRESCREEN_ELA_QUALITY)):
+            signals["ela"] = "non_applicable"
+        elif exif["format"] == "JPEG":
+            signals.update(error_level_analysis(original))
+            block_ratio = signals["ela_ratio_blocs"]
+            if block_ratio is not None and block_ratio > PRESCREEN_ELA_MAX_BLOCK_RATIO:
+                soft.append("ela_localisee")
+
+    # 5) Moiré d'écran
+    signals.update(moire_signals(work))
+    if (
+        signals["moire_ratio_pic"] > PRESCREEN_MOIRE_PEAK_RATIO
+        and signals["moire_dominance_chroma"] > PRESCREEN_MOIRE_MIN_CHROMA_DOMINANCE
+    ):
+        soft.append("moire_ecran")
+
+    score = round(sum(SOFT_SIGNAL_WEIGHTS[s] for s in soft), 2)
+    if hard or score >= PRESCREEN_REJECT_SCORE:
+        verdict = "rejet"
+    elif soft:
+        verdict = "suspect"
+    else:
+        verdict = "ok"
+
+    return {
+        "verdict": verdict,
+        "motifs": hard + soft,
+        "score_suspicion": score,
+        "signaux": signals,
+        "temps_ms": round((time.perf_counter() - start_time) * 1000, 2),
+    }
+
+
+def prescreen_document(pil_images: List[Image.Image], source_bytes: Optional[bytes] = None,
+                       resolution_scale: float = 1.0, ela: bool = True,
+                       originals: Optional[List[Image.Image]] = None) -> Dict:
+    """
+    Pré-contrôle de toutes les pages d'un document.
+    Le document est rejeté dès qu'une page l'est ; les rapports par page sont conservés.
+    """
+    originals = originals or [None] * len(pil_images)
+    pages = [
+        prescreen_page(img, source_bytes, resolution_scale, ela, original)
+        for img, original in zip(pil_images, originals)
+    ]
+
+    verdicts = [p["verdict"] for p in pages]
+    if "rejet" in verdicts:
+        verdict = "rejet"
+    elif "suspect" in verdicts:
+        verdict = "suspect"
+    else:
+        verdict = "ok"
+
+    motifs: List[str] = []
+    for p in pages:
+        motifs.extend(m for m in p["motifs"] if m not in motifs)
+
+    return {
+        "verdict": verdict,
+        "motifs": motifs,
+        "pages": pages,
+        "temps_ms": round(sum(p["temps_ms"] for p in pages), 2),
+    }
+
+
+def build_prescreen_rejection(doc_type: str, prescreen: Dict, info_fields: List[str]) -> Dict:
+    """
+    Réponse d'analyse (même forme que analyse_cni_file / analyse_passeport_file)
+    pour un document rejeté par le pré-contrôle, sans appel au modèle.
+    """
+    now = datetime.now()
+    return {
+        "rapport": {"prescreen": prescreen},
+        "score": 0,
+        "type_document": doc_type,
+        "date_analyse": f"{now.strftime('%d/%m/%Y')} à {now.strftime('%H:%M')}",
+        "info": {field: None for field in info_fields},
+        "verification_number": 0,
+        "justify": "Document rejeté par le pré-contrôle : " + ", ".join(prescreen["motifs"]),
+    }
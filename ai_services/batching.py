@@ -0,0 +1,280 @@
+""" Regroupement (micro-batching) des appels d'inférence page par page """
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List, Optional
+
+from ai_services.shared_state import SHARED_STATE, SHARED_STATE_ENABLED
+
+
+# =========================
+# CONFIG
+# =========================
+
+# Fenêtre de regroupement : les pages arrivant dans cet intervalle partent ensemble.
+# 0 désactive le regroupement (chaque page est envoyée directement).
+BATCH_WINDOW_MS = float(os.getenv("OCR_BATCH_WINDOW_MS", "0"))
+BATCH_MAX_SIZE = int(os.getenv("OCR_BATCH_MAX_SIZE", "8"))      # pages max par lot
+
+
+def batching_enabled() -> bool:
+    return BATCH_WINDOW_MS > 0 and BATCH_MAX_SIZE > 1
+
+
+def prefix_key(base_url: str, payload: Dict) -> str:
+    """
+    Clé de regroupement : backend + modèle + prompt système.
+    Deux pages de même clé partagent le même préfixe de prompt côté serveur.
+    """
+    system = [m.get("content") for m in payload.get("messages", []) if m.get("role") == "system"]
+    digest = hashlib.sha1(json.dumps(system, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+    return f"{base_url}|{payload.get('model')}|{digest}"
+
+
+# =========================
+# DISPATCHER
+# =========================
+
+class _PendingCall:
+    __slots__ = ("key", "send", "context", "future", "enqueued_at", "batch_size", "backend_peak")
+
+    def __init__(self, key: str, send: Callable):
+        self.key = key
+        self.send = send
+        self.context = contextvars.copy_context()   # trace de l'appelant
+        self.future = Future()
+        self.enqueued_at = time.perf_counter()
+        self.batch_size = 1
+        self.backend_peak = 0                       # max de requêtes de même préfixe en cours pendant l'envoi
+
+
+class MicroBatcher:
+    """
+    Collecte les appels soumis pendant `window_ms`, les groupe par préfixe
+    (modèle + prompt système) et émet chaque groupe d'un bloc : ses requêtes
+    partent simultanément, à la suite, vers le backend. Le batching continu
+    et le cache de préfixe (vLLM, llama.cpp) les traitent alors ensemble au
+    lieu de recalculer le prompt système à chaque page.
+
+    Un groupe est émis dès qu'il atteint `max_size`, les autres à la fin de la fenêtre.
+
+    Avec un budget (use_budget), tous les jetons d'un lot sont pris avant son
+    émission : le lot part d'un bloc au lieu d'être découpé par le budget.
+    Cette prise se fait hors du dispatcher, qui continue de regrouper et
+    d'émettre les autres préfixes pendant qu'un lot attend ses jetons.
+    """
+
+    def __init__(self, window_ms: float = BATCH_WINDOW_MS, max_size: int = BATCH_MAX_SIZE,
+                 send_workers: Optional[int] = None):
+        self.window_s = window_ms / 1000.0
+        self.max_size = max(1, max_size)
+        self.budget = None
+        self._queue: "queue.Queue[_PendingCall]" = queue.Queue()
+        self._pool = ThreadPoolExecutor(
+            max_workers=send_workers or 2 * self.max_size,
+            thread_name_prefix="ocr-lot",
+        )
+        # Lots en attente de jetons, servis dans l'ordre d'émission par un seul
+        # thread : deux lots partiellement servis ne peuvent pas s'attendre mutuellement
+        self._lots: List[List[_PendingCall]] = []
+        self._lots_cond = threading.Condition()
+        self._budget_thread = None
+        self._thread = None
+        self._start_lock = threading.Lock()
+        self._inflight: Dict[str, List[_PendingCall]] = {}
+        self._inflight_lock = threading.Lock()
+        self._metrics_lock = threading.Lock()
+        self._metrics = {
+            "lots": 0,
+            "requetes": 0,
+            "requetes_prefixe_partage": 0,
+            "attente_totale_s": 0.0,
+            "concurrence_backend_totale": 0,
+        }
+
+    def use_budget(self, budget, size: int) -> None:
+        """
+        Émet les lots sous `budget` (sémaphore de taille `size`) : la taille max
+        d'un lot est ramenée à `size`, sans quoi il ne pourrait jamais partir d'un
+        bloc. Les jetons sont pris par le dispatcher et rendus après chaque requête ;
+        `send()` ne doit alors plus prendre le budget lui-même.
+        """
+        self.budget = budget
+        self.max_size = max(1, min(self.max_size, size))
+
+    def submit(self, key: str, send: Callable) -> _PendingCall:
+        """
+        Met en file un appel ; `send()` sera exécuté dans le contexte de l'appelant
+        et son résultat (ou son exception) renvoyé via `call.future`.
+        """
+        self._ensure_started()
+        call = _PendingCall(key, send)
+        self._queue.put(call)
+        return call
+
+    def _ensure_started(self):
+        if self._thread is not None:
+            return
+        with self._start_lock:
+            if self._thread is None:
+                self._budget_thread = threading.Thread(target=self._budget_loop, name="ocr-lot-budget", daemon=True)
+                self._budget_thread.start()
+                self._thread = threading.Thread(target=self._loop, name="ocr-batcher", daemon=True)
+                self._thread.start()
+
+    def _loop(self):
+        while True:
+            first = self._queue.get()
+            groups: Dict[str, List[_PendingCall]] = {first.key: [first]}
+            deadline = time.perf_counter() + self.window_s
+
+            if len(groups[first.key]) >= self.max_size:
+                self._flush(groups.pop(first.key))
+
+            while True:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    call = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                group = groups.setdefault(call.key, [])
+                group.append(call)
+                if len(group) >= self.max_size:
+                    self._flush(groups.pop(call.key))
+
+            for group in groups.values():
+                self._flush(group)
+
+    def _flush(self, group: List[_PendingCall]):
+        if not group:
+            return
+        if self.budget is None:
+            self._send_lot(group)
+            return
+        with self._lots_cond:
+            self._lots.append(group)
+            self._lots_cond.notify()
+
+    def _budget_loop(self):
+        while True:
+            with self._lots_cond:
+                while not self._lots:
+                    self._lots_cond.wait()
+                group = self._lots.pop(0)
+                # les lots de même préfixe émis entre-temps rejoignent celui-ci
+                for other in list(self._lots):
+                    if other[0].key == group[0].key and len(group) + len(other) <= self.max_size:
+                        group = group + other
+                        self._lots.remove(other)
+            self._acquire_and_send(group)
+
+    def _acquire_and_send(self, group: List[_PendingCall]):
+        # jetons du lot pris d'un bloc (entre workers, SharedSemaphore.acquire_many
+        # sérialise aussi les prises groupées)
+        try:
+            acquire_many = getattr(self.budget, "acquire_many", None)
+            if acquire_many is not None:
+                acquire_many(len(group))
+            else:
+                for _ in group:
+                    self.budget.acquire()
+        except BaseException as e:
+            for call in group:
+                call.future.set_exception(e)
+            return
+        self._send_lot(group)
+
+    def _send_lot(self, group: List[_PendingCall]):
+        now = time.perf_counter()
+        self._add_metrics({
+            "lots": 1,
+            "requetes": len(group),
+            "requetes_prefixe_partage": len(group) if len(group) > 1 else 0,
+            "attente_totale_s": sum(now - c.enqueued_at for c in group),
+        })
+
+        for call in group:
+            call.batch_size = len(group)
+            self._pool.submit(call.context.run, self._run, call)
+
+    def _run(self, call: _PendingCall):
+        self._enter_backend(call)
+        try:
+            call.future.set_result(call.send())
+        except BaseException as e:
+            call.future.set_exception(e)
+        finally:
+            self._exit_backend(call)
+            if self.budget is not None:
+                self.budget.release()
+            self._add_metrics({"concurrence_backend_totale": call.backend_peak})
+
+    def _enter_backend(self, call: _PendingCall):
+        """
+        Concurrence réellement vue par le backend : pour chaque requête, nombre
+        maximal de requêtes de même préfixe en cours pendant son envoi.
+        """
+        with self._inflight_lock:
+            running = self._inflight.setdefault(call.key, [])
+            running.append(call)
+            for other in running:
+                other.backend_peak = max(other.backend_peak, len(running))
+
+    def _exit_backend(self, call: _PendingCall):
+        with self._inflight_lock:
+            running = self._inflight[call.key]
+            running.remove(call)
+            if not running:
+                del self._inflight[call.key]
+
+    def _add_metrics(self, delta: Dict[str, float]):
+        with self._metrics_lock:
+            for name, value in delta.items():
+                self._metrics[name] += value
+        if SHARED_STATE_ENABLED:
+            # registre commun aux workers : /metrics/batching agrège tous les processus
+            SHARED_STATE.counters_add({f"batching.{k}": v for k, v in delta.items()})
+
+    def metrics(self) -> Dict:
+        """
+        taille_moyenne_lot : remplissage des lots côté client (file d'attente).
+        concurrence_backend_moyenne : requêtes de même préfixe effectivement en
+        cours ensemble au backend, mesurée pendant l'envoi HTTP de chaque requête.
+        efficacite_batching : concurrence_backend_moyenne / taille max de lot.
+        taux_prefixe_partage : part des requêtes émises avec au moins une autre de même préfixe.
+        En mode multi-workers, les compteurs sont ceux de tous les processus (la
+        concurrence est mesurée par processus, la file est celle du processus courant).
+        """
+        with self._metrics_lock:
+            m = dict(self._metrics)
+        if SHARED_STATE_ENABLED:
+            m = {**{k: 0 for k in m}, **SHARED_STATE.counters("batching.")}
+        lots, reqs = m["lots"], m["requetes"]
+        return {
+            "actif": batching_enabled(),
+            "tous_workers": SHARED_STATE_ENABLED,
+            "fenetre_ms": self.window_s * 1000.0,
+            "taille_max_lot": self.max_size,
+            "lots": lots,
+            "requetes": reqs,
+            "taille_moyenne_lot": round(reqs / lots, 3) if lots else 0.0,
+            "concurrence_backend_moyenne": round(m["concurrence_backend_totale"] / reqs, 3) if reqs else 0.0,
+            "efficacite_batching": round(m["concurrence_backend_totale"] / (reqs * self.max_size), 4) if reqs else 0.0,
+            "taux_prefixe_partage": round(m["requetes_prefixe_partage"] / reqs, 4) if reqs else 0.0,
+            "attente_moyenne_ms": round(1000.0 * m["attente_totale_s"] / reqs, 2) if reqs else 0.0,
+            "file_attente": self._queue.qsize(),
+        }
+
+
+BATCHER = MicroBatcher()
+
+
+def batching_metrics() -> Dict:
+    return BATCHER.metrics()
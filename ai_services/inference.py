@@ -0,0 +1,166 @@
+""" Couche commune d'appel au serveur d'inférence (API OpenAI-like de LM Studio) """
+import json
+import os
+import threading
+import time
+from typing import Dict, Optional
+
+import requests
+
+from ai_services.batching import BATCHER, batching_enabled, prefix_key
+from ai_services.shared_state import SHARED_STATE_ENABLED, SharedSemaphore
+from ai_services.tracing import span
+from ai_services.usage import extract_usage, record_usage
+
+
+# =========================
+# CONFIG LM STUDIO
+# =========================
+
+LMSTUDIO_API_KEY = "lm-studio"               # valeur par défaut pour LM Studio
+LMSTUDIO_TIMEOUT = 120                       # secondes
+
+_stats_lock = threading.Lock()               # stats partagées entre pages analysées en parallèle
+
+# Budget d'inférence partagé par toutes les analyses : au plus N requêtes
+# simultanées vers le backend, quel que soit l'endpoint. En mode production
+# multi-workers, le budget est commun à tous les processus (SharedSemaphore).
+INFERENCE_CONCURRENCY = int(os.getenv("OCR_INFERENCE_CONCURRENCY", "4"))
+if SHARED_STATE_ENABLED:
+    INFERENCE_BUDGET = SharedSemaphore("inference", INFERENCE_CONCURRENCY)
+else:
+    INFERENCE_BUDGET = threading.BoundedSemaphore(INFERENCE_CONCURRENCY)
+
+# Lots émis sous le même budget, pris d'un bloc : un lot n'est jamais découpé
+BATCHER.use_budget(INFERENCE_BUDGET, INFERENCE_CONCURRENCY)
+
+
+# =========================
+# STATISTIQUES PAR DOCUMENT
+# =========================
+
+def new_inference_stats(doc_type: Optional[str] = None) -> Dict:
+    """
+    Crée un accumulateur de statistiques d'inférence pour un document.
+    Il est passé aux fonctions d'appel LLM qui l'incrémentent à chaque requête ;
+    `doc_type` sert de dimension à la comptabilité d'usage (ai_services.usage).
+    """
+    return {
+        "type_document": doc_type,
+        "appels_llm": 0,
+        "payload_octets": 0,
+        "temps_inference_s": 0.0,
+        "prompt_tokens": 0,
+        "completion_tokens": 0,
+    }
+
+
+# =========================
+# APPEL HTTP
+# =========================
+
+def post_chat_completion(
+    lm_studio_base_url: str,
+    payload: Dict,
+    api_key: str = LMSTUDIO_API_KEY,
+    stats: Optional[Dict] = None,
+    timeout: int = LMSTUDIO_TIMEOUT,
+) -> Dict:
+    """
+    Envoie un payload /v1/chat/completions et retourne la réponse JSON décodée.
+
+    Si `stats` est fourni (voir new_inference_stats), on y cumule le nombre
+    d'appels, la taille du corps envoyé, le temps passé côté serveur et les
+    tokens consommés. Chaque requête est aussi enregistrée dans la base
+    d'usage (ai_services.usage).
+    """
+    headers = {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {api_key}",
+    }
+    body = json.dumps(payload).encode("utf-8")
+
+    url = f"{lm_studio_base_url}/v1/chat/completions"
+    start_time = time.perf_counter()
+    try:
+        if batching_enabled():
+            # Regroupement avec les autres pages de même prompt arrivées dans la fenêtre
+            with span("llm.attente_lot") as s:
+                call = BATCHER.submit(
+                    prefix_key(lm_studio_base_url, payload),
+                    lambda: _send_request(url, headers, body, timeout, acquire_budget=False),
+                )
+                resp, elapsed_time = call.future.result()
+                if s is not None:
+                    s.set_attribute("taille_lot", call.batch_size)
+        else:
+            resp, elapsed_time = _send_request(url, headers, body, timeout)
+    except requests.RequestException:
+        # délai dépassé, connexion refusée... : la requête compte quand même dans l'usage
+        record_usage(
+            (stats or {}).get("type_document"),
+            payload,
+            lm_studio_base_url,
+            extract_usage(None),
+            payload_octets=len(body),
+            temps_s=time.perf_counter() - start_time,
+            erreur=True,
+        )
+        raise
+
+    ok = resp.status_code == 200
+    data = resp.json() if ok else None
+    usage = extract_usage(data)
+
+    if stats is not None:
+        with _stats_lock:
+            stats["appels_llm"] += 1
+            stats["payload_octets"] += len(body)
+            stats["temps_inference_s"] += elapsed_time
+            stats["prompt_tokens"] += usage["prompt_tokens"]
+            stats["completion_tokens"] += usage["completion_tokens"]
+
+    record_usage(
+        (stats or {}).get("type_document"),
+        payload,
+        lm_studio_base_url,
+        usage,
+        payload_octets=len(body),
+        temps_s=elapsed_time,
+        erreur=not ok,
+    )
+
+    if not ok:
+        raise RuntimeError(
+            f"Erreur LM Studio ({resp.status_code}): {resp.text}"
+        )
+
+    return data
+
+
+def _send_request(url: str, headers: Dict, body: bytes, timeout: int, acquire_budget: bool = True):
+    """
+    Requête HTTP unitaire sous le budget d'inférence ; retourne (réponse, durée en s).
+    acquire_budget=False : jeton déjà pris pour tout le lot par le MicroBatcher.
+    """
+    if not acquire_budget:
+        return _post(url, headers, body, timeout)
+
+    with span("llm.attente_budget"):
+        INFERENCE_BUDGET.acquire()
+    try:
+        return _post(url, headers, body, timeout)
+    finally:
+        INFERENCE_BUDGET.release()
+
+
+def _post(url: str, headers: Dict, body: bytes, timeout: int):
+    with span("llm.http", **{"http.url": url, "payload_octets": len(body)}) as s:
+        start_time = time.perf_counter()
+        resp = requests.post(url, headers=headers, data=body, timeout=timeout)
+        elapsed_time = time.perf_counter() - start_time
+        if s is not None:
+            s.set_attribute("http.status_code", resp.status_code)
+            s.set_attribute("http.temps_entetes_s", resp.elapsed.total_seconds())
+            s.set_attribute("reponse_octets", len(resp.content))
+    return resp, elapsed_time
@@ -0,0 +1,152 @@
+""" Suivi des analyses en cours et drainage gracieux à l'arrêt ou au rechargement d'un worker """
+import os
+import signal
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+from ai_services.inference import INFERENCE_BUDGET, INFERENCE_CONCURRENCY
+from ai_services.shared_state import SHARED_STATE, SHARED_STATE_ENABLED
+
+
+# =========================
+# CONFIG
+# =========================
+
+# Temps laissé aux analyses en cours pour se terminer (à aligner sur graceful_timeout de gunicorn)
+DRAIN_TIMEOUT_S = int(os.getenv("OCR_DRAIN_TIMEOUT_S", "180"))
+
+_DRAIN_SIGNALS = [signal.SIGTERM, signal.SIGINT]
+
+
+# =========================
+# ANALYSES EN COURS
+# =========================
+
+class InflightTracker:
+    """
+    Compte les analyses OCR en cours dans le processus. Une fois le drainage
+    commencé, les nouvelles analyses sont refusées et l'arrêt attend que le
+    compteur retombe à zéro.
+
+    En mode multi-workers, le compteur reste en mémoire : enter/exit (appelés
+    depuis la boucle d'événements) ne font que signaler un changement, et un
+    thread de publication écrit la dernière valeur dans l'état partagé.
+    """
+
+    def __init__(self):
+        self._count = 0
+        self._draining = False
+        self._cond = threading.Condition()
+        self._changed = threading.Event()
+        self._publisher_pid = None
+
+    def enter(self) -> bool:
+        with self._cond:
+            if self._draining:
+                return False
+            self._count += 1
+        self._publish()
+        return True
+
+    def exit(self) -> None:
+        with self._cond:
+            self._count -= 1
+            self._cond.notify_all()
+        self._publish()
+
+    def begin_drain(self) -> None:
+        with self._cond:
+            if self._draining:
+                return
+            self._draining = True
+            count = self._count
+        print(f"### >>> Worker {os.getpid()} : drainage, {count} analyse(s) en cours  <<< ###")
+
+    def wait_drained(self, timeout_s: float = DRAIN_TIMEOUT_S) -> int:
+        """
+        Attend la fin des analyses en cours ; retourne le nombre encore actives au délai.
+        """
+        deadline = time.monotonic() + timeout_s
+        with self._cond:
+            while self._count > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._cond.wait(remaining)
+            return self._count
+
+    @property
+    def draining(self) -> bool:
+        return self._draining
+
+    @property
+    def count(self) -> int:
+        return self._count
+
+    def _publish(self) -> None:
+        if not SHARED_STATE_ENABLED:
+            return
+        if self._publisher_pid != os.getpid():
+            # Démarré dans le worker (un thread du maître préchargé ne survit pas au fork)
+            with self._cond:
+                if self._publisher_pid != os.getpid():
+                    self._publisher_pid = os.getpid()
+                    threading.Thread(target=self._publish_loop, name="jauge-analyses", daemon=True).start()
+        self._changed.set()
+
+    def _publish_loop(self) -> None:
+        while True:
+            self._changed.wait()
+            self._changed.clear()
+            try:
+                SHARED_STATE.gauge_set("analyses_en_cours", self._count)
+            except sqlite3.Error as e:
+                print(f"### >>> Jauge des analyses en cours non publiée : {e}  <<< ###")
+
+
+INFLIGHT = InflightTracker()
+
+
+def install_drain_signal_handlers() -> None:
+    """
+    Chaîne un passage en drainage devant les gestionnaires de signaux déjà
+    installés (uvicorn, worker gunicorn) : dès le signal d'arrêt ou de
+    rechargement, les nouvelles analyses sont refusées (503) pendant que
+    celles en cours se terminent. À appeler depuis le thread principal.
+    """
+    if threading.current_thread() is not threading.main_thread():
+        return                                # serveur embarqué (tests) : signaux gérés ailleurs
+
+    for sig in _DRAIN_SIGNALS:
+        previous = signal.getsignal(sig)
+        if not callable(previous):
+            continue
+
+        def handler(signum, frame, previous=previous):
+            INFLIGHT.begin_drain()
+            previous(signum, frame)
+
+        signal.signal(sig, handler)
+
+
+def workers_report() -> Dict:
+    """
+    Analyses en cours par worker et occupation du budget d'inférence commun.
+    """
+    if not SHARED_STATE_ENABLED:
+        return {
+            "mode": "processus_unique",
+            "workers": {str(os.getpid()): {"analyses_en_cours": INFLIGHT.count, "drainage": INFLIGHT.draining}},
+            "budget_inference": {"taille": INFERENCE_CONCURRENCY},
+        }
+
+    return {
+        "mode": "multi_workers",
+        "workers": {
+            str(pid): {"analyses_en_cours": int(value)}
+            for pid, value in SHARED_STATE.gauges("analyses_en_cours").items()
+        },
+        "budget_inference": {"taille": INFERENCE_CONCURRENCY, "utilise": INFERENCE_BUDGET.in_use()},
+    }
@@ -1,15 +1,115 @@
+import contextvars
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List
+
 from ai_services.utils import execution_timer
 
+from ai_services.analytics.coherence import check_dossier_consistency, compute_dossier_score
 from ai_services.ocr import cni, passeport, permis_conduire, rccm
 
 
+DOSSIER_MAX_WORKERS = int(os.getenv("OCR_DOSSIER_MAX_WORKERS", "4"))   # documents d'un dossier analysés en parallèle
+
+
 class OcrProcessing:
+    """
+    Aiguille un document vers l'analyseur correspondant à son type
+    (libellé tel qu'envoyé par l'UI : "Carte Nationale d'Identité", "Passeport", ...).
+    """
 
-    def __init__(self, doc_name, file_bytes):
+    def __init__(self, doc_name, file_bytes, filename, lm_studio_url, adaptive=True, precompresse=False):
         self.doc_name =  doc_name
         self.file_bytes =  file_bytes
+        self.filename = filename
+        self.lm_studio_url = lm_studio_url
+        self.adaptive = adaptive
+        self.precompresse = precompresse        # image ré-encodée par le navigateur : ELA non applicable
 
 
     @execution_timer
-    def make_ocr():
-        pass
\ No newline at end of file
+    def make_ocr(self):
+        if "Carte Nationale d'Identité" in self.doc_name:
+            return cni.analyse_cni_file(
+                file_bytes=self.file_bytes,
+                filename=self.filename,
+                pdf_scale=2.0,
+                lm_studio_url=self.lm_studio_url,
+                adaptive=self.adaptive,
+                precompresse=self.precompresse,
+            )
+
+        if "RCCM" in self.doc_name:
+            return rccm.analyse_rccm_file(
+                file_bytes=self.file_bytes,
+                filename=self.filename,
+                pdf_scale=2.0,
+                lm_studio_url=self.lm_studio_url,
+            )
+
+        if "Permis" in self.doc_name:
+            return permis_conduire.analyse_permis_file(
+                file_bytes=self.file_bytes,
+                filename=self.filename,
+                pdf_scale=2.0,
+                lm_studio_url=self.lm_studio_url,
+                adaptive=self.adaptive,
+                precompresse=self.precompresse,
+            )
+
+        return passeport.analyse_passeport_file(
+            file_bytes=self.file_bytes,
+            filename=self.filename,
+            pdf_scale=2.0,
+            lm_studio_url=self.lm_studio_url,
+            adaptive=self.adaptive,
+            precompresse=self.precompresse,
+        )
+
+
+@execution_timer
+def analyse_dossier(documents: List[Dict], lm_studio_url: str, adaptive: bool = True,
+                    max_workers: int = DOSSIER_MAX_WORKERS) -> Dict:
+    """
+    Analyse tous les documents d'un client en parallèle puis contrôle leur cohérence.
+
+    documents : [{"type_document": str, "filename": str, "file_bytes": bytes}, ...]
+
+    Les documents partagent les budgets du processus : rendu / décodage
+    (ai_services.ocr.pages.RENDER_BUDGET) et requêtes au modèle
+    (ai_services.inference.INFERENCE_BUDGET). Un document en erreur
+    n'interrompt pas les autres.
+    """
+    def run(doc):
+        return OcrProcessing(
+            doc["type_document"], doc["file_bytes"], doc["filename"], lm_studio_url, adaptive
+        ).make_ocr()
+
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(documents)))) as pool:
+        futures = [pool.submit(contextvars.copy_context().run, run, doc) for doc in documents]
+
+    reports = []
+    for i, (doc, future) in enumerate(zip(documents, futures)):
+        entry = {
+            "libelle": f"{i + 1}:{doc['type_document']}",
+            "fichier": doc["filename"],
+            "type_document": doc["type_document"],
+        }
+        try:
+            entry["model_response"] = future.result()
+        except Exception as e:
+            entry["erreur"] = str(e)
+        reports.append(entry)
+
+    analysed = [
+        {"libelle": r["libelle"], "type_document": r["type_document"],
+         "info": r["model_response"].get("info"), "score": r["model_response"].get("score")}
+        for r in reports if "model_response" in r
+    ]
+    checks = check_dossier_consistency(analysed)
+
+    return {
+        "documents": reports,
+        "coherence": checks,
+        "score_dossier": compute_dossier_score(analysed, checks),
+    }
@@ -1,18 +1,23 @@
-import base64
-import io
 import json
-import os
-import tempfile
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 
-import requests
 from PIL import Image
-import pypdfium2 as pdfium
 import pandas as pd
 from datetime import datetime
 
 from random import Random
 
+from ai_services.analytics.prescreen import build_prescreen_rejection
+from ai_services.inference import post_chat_completion
+from ai_services.tracing import span
+from ai_services.utils import execution_timer
+from ai_services.ocr.pages import (
+    JPEG_QUALITY_HIGH,
+    analyse_document_pages,
+    parse_date,
+    pil_to_base64_jpeg,
+)
+
 
 
 # =========================
@@ -44,61 +49,6 @@ VERSO_HINT_FIELDS = [
 
 CNI_FIELDS = ["face"] + RECTO_HINT_FIELDS + VERSO_HINT_FIELDS
 
-# =========================
-# UTILITAIRES PDF -> IMAGES
-# =========================
-
-def pdf_bytes_to_pil_images(pdf_bytes: bytes, scale: float = 2.0) -> List[Image.Image]:
-    """
-    Convertit un PDF (en bytes) en une liste d'images PIL (une par page).
-    Utilise pypdfium2 (API récente : page.render(...).to_pil()).
-    Gère le cas Windows où le fichier temporaire peut rester verrouillé.
-    """
-    images: List[Image.Image] = []
-
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        tmp.write(pdf_bytes)
-        tmp_path = tmp.name
-
-    try:
-        pdf = pdfium.PdfDocument(tmp_path)
-        n_pages = len(pdf)
-
-        for i in range(n_pages):
-            page = pdf.get_page(i)
-            bitmap = page.render(
-                scale=scale,
-                rotation=0,
-                crop=(0, 0, 0, 0),
-            )
-            pil_image = bitmap.to_pil()
-            images.append(pil_image.convert("RGB"))
-            bitmap.close()
-            page.close()
-
-        pdf.close()
-
-    finally:
-        try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except PermissionError:
-            # Sous Windows : peut arriver si le handle n'est pas encore relâché
-            pass
-
-    return images
-
-
-def pil_to_base64_jpeg(img: Image.Image, quality: int = 90) -> str:
-    """
-    Convertit une image PIL en base64 (JPEG).
-    """
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=quality)
-    img_bytes = buf.getvalue()
-    return base64.b64encode(img_bytes).decode("utf-8")
-
-
 # =========================
 # PROMPT & APPEL LLM
 # =========================
@@ -166,13 +116,20 @@ Ne renvoie aucun texte en dehors de ce JSON.
 """.strip()
 
 
-def call_lmstudio_vision_analyse_cni(pil_image: Image.Image, lm_studio_base_url:str) -> Dict:
+def call_lmstudio_vision_analyse_cni(
+    pil_image: Image.Image,
+    lm_studio_base_url:str,
+    jpeg_quality: int = JPEG_QUALITY_HIGH,
+    stats: Optional[Dict] = None,
+) -> Dict:
     """
     Appelle LM Studio (API OpenAI-like) avec un modèle multimodal (ex: qwen3-vl-8b-instruct)
     pour analyser une CNI. Aucun historique n'est envoyé -> contexte vidé à chaque appel.
+    `stats` (optionnel) cumule appels, taille de payload et temps d'inférence.
     """
     system_prompt = build_cni_prompt()
-    img_b64 = pil_to_base64_jpeg(pil_image)
+    with span("encodage_jpeg", qualite=jpeg_quality):
+        img_b64 = pil_to_base64_jpeg(pil_image, quality=jpeg_quality)
 
     payload = {
         "model": LMSTUDIO_MODEL_ID,
@@ -203,20 +160,12 @@ def call_lmstudio_vision_analyse_cni(pil_image: Image.Image, lm_studio_base_url:
         ],
     }
 
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Bearer {LMSTUDIO_API_KEY}",
-    }
-
-    url = f"{lm_studio_base_url}/v1/chat/completions"
-    resp = requests.post(url, headers=headers, json=payload, timeout=120)
-
-    if resp.status_code != 200:
-        raise RuntimeError(
-            f"Erreur LM Studio ({resp.status_code}): {resp.text}"
-        )
-
-    data = resp.json()
+    data = post_chat_completion(
+        lm_studio_base_url,
+        payload,
+        api_key=LMSTUDIO_API_KEY,
+        stats=stats,
+    )
     try:
         content = data["choices"][0]["message"]["content"]
     except (KeyError, IndexError) as e:
@@ -345,6 +294,54 @@ def build_cni_table(results: List[Dict], fused: Dict) -> pd.DataFrame:
     return df
 
 
+# =========================
+# RÉSOLUTION ADAPTATIVE
+# =========================
+
+def cni_missing_fields(res: Dict) -> List[str]:
+    """
+    Liste les champs requis (selon la face détectée) absents ou invalides.
+    Une face 'inconnu' est considérée comme entièrement manquante.
+    """
+    face = res.get("face") or "inconnu"
+    if face == "recto":
+        required = RECTO_HINT_FIELDS
+    elif face == "verso":
+        required = VERSO_HINT_FIELDS
+    else:
+        return ["face"]
+
+    missing = []
+    for f in required:
+        val = res.get(f)
+        if val is None or val == "":
+            missing.append(f)
+        elif f.startswith("date_") and parse_date(val) is None:
+            missing.append(f)
+        elif f == "numero_cni" and (not isinstance(val, str) or "CI" not in val.replace(" ", "").upper()):
+            missing.append(f)
+
+    return missing
+
+
+def merge_escalated_cni_result(low: Dict, high: Dict) -> Dict:
+    """
+    Fusionne le résultat basse résolution d'une page avec celui de son
+    ré-passage haute résolution : la haute résolution est prioritaire,
+    les champs qu'elle laisse vides sont complétés par la basse résolution
+    si les deux passages s'accordent sur la face.
+    """
+    if high.get("face") == "inconnu":
+        return low if low.get("face") != "inconnu" else high
+
+    merged = dict(high)
+    if low.get("face") == high.get("face"):
+        for f in CNI_FIELDS:
+            if merged.get(f) in (None, "") and low.get(f) not in (None, ""):
+                merged[f] = low[f]
+    return merged
+
+
 # ===========================================
 # FONCTION FINALE A APPELER DANS LE FRONT END
 # ===========================================
@@ -413,67 +410,85 @@ def compute_score_from_results(results: list):
     return data
 
 
+def fuse_and_score_cni(results: List[Dict]) -> Tuple[Dict, int]:
+    """
+    Fusionne les pages nettoyées (recto et verso, éventuellement issues
+    d'envois séparés) et calcule le score sur l'enregistrement fusionné.
+
+    Retourne (info, score) : info au format de la réponse API (numero_doc).
+    """
+    fused = fuse_cni_results(clean_results_by_face(results))
+    score = compute_score_from_results([fused]).get("score")
+
+    info = dict(fused)
+    # remplacer numero_cni par numero_doc
+    info["numero_doc"] = info.pop("numero_cni")
+    return info, score
+
+
+@execution_timer
 def analyse_cni_file(
     file_bytes: bytes,
     filename: str,
     lm_studio_url:str,
     pdf_scale: float = 2.0, 
     doc_type = "Carte Nationale d'Identité",
-    seuil_score = 75
-    
-) -> Tuple[List[Image.Image], List[Dict], List[str], Dict, pd.DataFrame]:
+    seuil_score = 75,
+    adaptive: bool = True,
+    prescreen: bool = True,
+    precompresse: bool = False,
+) -> Dict:
     """
     Analyse un fichier CNI (PDF ou image) multi-pages.
 
     Pipeline :
-    - PDF / image -> liste d'images (une par page)
-    - LLM sur chaque page -> raw_results (avec "face" déjà rempli par le modèle)
+    - analyse_document_pages (ai_services.ocr.pages) : rendu, pré-contrôle
+      forensique, premier passage basse résolution puis escalade des seules
+      pages incomplètes (cni_missing_fields, merge_escalated_cni_result)
     - clean_results_by_face(raw_results) -> results nettoyés
-    - extraction de la liste faces à partir des results
-    - fuse_cni_results(results) -> fused
-    - build_cni_table(results, fused) -> df_table
-
-    Retourne :
-    - pil_images : liste d'images PIL (une par page)
-    - results    : liste de dicts nettoyés (une par page)
-    - faces      : liste de 'recto'/'verso'/'inconnu' par page
-    - fused      : dict fusionné (vision globale de la CNI)
-    - df_table   : DataFrame (fusion + valeurs par page)
-    """
-    ext = os.path.splitext(filename)[1].lower()
+    - fuse_and_score_cni(results) -> fusion recto/verso et score
 
-    # 1) PDF / image -> liste d'images
-    if ext == ".pdf":
-        pil_images = pdf_bytes_to_pil_images(file_bytes, scale=pdf_scale)
-        if not pil_images:
-            raise ValueError("Impossible de rendre le PDF en images.")
-    else:
-        pil_images = [Image.open(io.BytesIO(file_bytes)).convert("RGB")]
-
-    # 2) Appel LLM sur chaque page -> raw_results
-    raw_results: List[Dict] = []
-    for img in pil_images:
-        res = call_lmstudio_vision_analyse_cni(img, lm_studio_base_url = lm_studio_url)
-        raw_results.append(res)
+    Retourne la réponse d'analyse (rapport, score, info, escalade, pages).
+    """
+    analysis = analyse_document_pages(
+        file_bytes,
+        filename,
+        lm_studio_url,
+        doc_type,
+        call_model=call_lmstudio_vision_analyse_cni,
+        missing_fields=cni_missing_fields,
+        merge_escalated=merge_escalated_cni_result,
+        pdf_scale=pdf_scale,
+        adaptive=adaptive,
+        prescreen=prescreen,
+        precompresse=precompresse,
+    )
+    prescreen_report = analysis["prescreen"]
+    if analysis["pages"] is None:
+        return build_prescreen_rejection(
+            doc_type, prescreen_report, ["numero_doc"] + RECTO_HINT_FIELDS[1:] + VERSO_HINT_FIELDS
+        )
+    raw_results = analysis["pages"]
+    escalation = analysis["escalade"]
 
     # 3) Nettoyer les résultats selon la face indiquée par le LLM
     results = clean_results_by_face(raw_results)
     print(results)
 
-    score =  compute_score_from_results(results).get('score')
-    info =  dict(results[0])
-    # remplacer numero_cni par numero_doc
-    info["numero_doc"] = info.pop("numero_cni")
+    # 4) Fusion recto/verso puis score sur l'enregistrement fusionné
+    info, score = fuse_and_score_cni(results)
     verif_number = 3 # nombre de verification (Verif sur le numero de cni, sur la date de naissance, date d'emission )
     justify =  "Document acceptable aux standards de Passeport Internationaux" if verif_number > seuil_score else "Document Non-Conforme !"
 
 
     return  {
-            "rapport":None, 
+            "rapport": {"prescreen": prescreen_report}, 
             "score":score, 
             "type_document":doc_type,
             "date_analyse": f"{datetime.now().strftime("%d/%m/%Y")} à {datetime.now().strftime("%H:%M")}",
             "info":info, 
             "verification_number": verif_number,
-            "justify": justify
+            "justify": justify,
+            "escalade": escalation,
+            "pages": results,
     }
\ No newline at end of file
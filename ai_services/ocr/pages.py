@@ -0,0 +1,306 @@
+""" Utilitaires communs de rendu des pages (PDF / images) et pipeline page par page des analyseurs OCR """
+import base64
+import contextvars
+import io
+import os
+import re
+import threading
+import unicodedata
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from PIL import Image
+import pypdfium2 as pdfium
+
+from ai_services.analytics.prescreen import prescreen_document
+from ai_services.inference import new_inference_stats
+from ai_services.tracing import span
+
+
+# =========================
+# RÉSOLUTION ADAPTATIVE
+# =========================
+# Premier passage à basse résolution ; on ne repasse à la résolution
+# "haute" (pdf_scale de l'appelant, JPEG 90, image d'origine) que pour les
+# pages dont les champs requis sont absents ou invalides.
+
+ADAPTIVE_PDF_SCALE_LOW = 1.0
+ADAPTIVE_IMAGE_MAX_SIDE_LOW = 1280
+ADAPTIVE_JPEG_QUALITY_LOW = 75
+JPEG_QUALITY_HIGH = 90
+IMAGE_MAX_SIDE_HIGH = 2000       # px, résolution max utile ; l'UI pré-réduit les photos à cette taille
+
+
+# =========================
+# BUDGET DE RENDU PARTAGÉ
+# =========================
+# pdfium n'est pas thread-safe : tous les appels passent par PDFIUM_LOCK.
+# Décodage et redimensionnement d'images (CPU) sont bornés par RENDER_BUDGET,
+# partagé par toutes les analyses concurrentes du processus (dossiers compris).
+
+PDFIUM_LOCK = threading.RLock()
+RENDER_BUDGET = threading.BoundedSemaphore(int(os.getenv("OCR_RENDER_CONCURRENCY", str(os.cpu_count() or 2))))
+
+
+# =========================
+# RENDU
+# =========================
+
+def render_pdf_pages(
+    pdf_bytes: bytes,
+    scale: float = 2.0,
+    page_indexes: Optional[Sequence[int]] = None,
+) -> List[Image.Image]:
+    """
+    Rend les pages d'un PDF (en bytes) en images PIL RGB.
+    Si `page_indexes` est fourni, seules ces pages (index 0-based) sont rendues,
+    ce qui permet de ré-escalader une seule page sans tout re-rasteriser.
+    """
+    with span("rendu_pdf", scale=scale), PDFIUM_LOCK:
+        return _render(pdf_bytes, scale, page_indexes)
+
+
+def _render(pdf_bytes: bytes, scale: float, page_indexes: Optional[Sequence[int]]) -> List[Image.Image]:
+    images: List[Image.Image] = []
+
+    pdf = pdfium.PdfDocument(pdf_bytes)
+    try:
+        n_pages = len(pdf)
+        indexes = range(n_pages) if page_indexes is None else page_indexes
+        for i in indexes:
+            if i >= n_pages:
+                continue
+            page = pdf.get_page(i)
+            bitmap = page.render(scale=scale, rotation=0)
+            images.append(bitmap.to_pil().convert("RGB"))
+            bitmap.close()
+            page.close()
+    finally:
+        pdf.close()
+
+    return images
+
+
+def iter_pdf_pages(pdf_bytes: bytes, scale: float = 2.0) -> Iterator[Tuple[int, Image.Image]]:
+    """
+    Rend les pages d'un PDF une à une (index 0-based, image PIL RGB).
+    Permet de lancer l'analyse d'une page pendant le rendu des suivantes
+    sans garder tout le document rasterisé en mémoire.
+    """
+    with PDFIUM_LOCK:
+        pdf = pdfium.PdfDocument(pdf_bytes)
+        n_pages = len(pdf)
+    try:
+        for i in range(n_pages):
+            with span("rendu_pdf_page", page=i + 1, scale=scale), PDFIUM_LOCK:
+                page = pdf.get_page(i)
+                bitmap = page.render(scale=scale, rotation=0)
+                image = bitmap.to_pil().convert("RGB")
+                bitmap.close()
+                page.close()
+            yield i, image
+    finally:
+        with PDFIUM_LOCK:
+            pdf.close()
+
+
+def load_image(file_bytes: bytes) -> Image.Image:
+    """
+    Décode une image (JPEG / PNG) en image PIL RGB.
+    """
+    with RENDER_BUDGET:
+        return Image.open(io.BytesIO(file_bytes)).convert("RGB")
+
+
+def downscale_to_max_side(img: Image.Image, max_side: int) -> Image.Image:
+    """
+    Réduit une image pour que son plus grand côté ne dépasse pas `max_side`.
+    Retourne l'image d'origine si elle est déjà assez petite.
+    """
+    if max(img.size) <= max_side:
+        return img
+
+    with RENDER_BUDGET:
+        small = img.copy()
+        small.thumbnail((max_side, max_side), Image.LANCZOS)
+    return small
+
+
+# =========================
+# UTILITAIRES COMMUNS
+# =========================
+
+def pil_to_base64_jpeg(img: Image.Image, quality: int = 90) -> str:
+    """
+    Convertit une image PIL en base64 (JPEG).
+    """
+    buf = io.BytesIO()
+    img.save(buf, format="JPEG", quality=quality)
+    return base64.b64encode(buf.getvalue()).decode("utf-8")
+
+
+def parse_date(value) -> Optional[datetime]:
+    """
+    Date au format "dd/mm/yyyy" renvoyée par le modèle ; None si absente ou invalide.
+    """
+    try:
+        return datetime.strptime(value.strip(), "%d/%m/%Y")
+    except (AttributeError, TypeError, ValueError):
+        return None
+
+
+def normalize_text(value) -> Optional[str]:
+    """
+    Clé de comparaison : majuscules, sans accents ni ponctuation.
+    None si la valeur n'est pas une chaîne non vide.
+    """
+    if not isinstance(value, str) or not value.strip():
+        return None
+    text = unicodedata.normalize("NFKD", value)
+    text = "".join(c for c in text if not unicodedata.combining(c))
+    return re.sub(r"[^A-Z0-9]+", " ", text.upper()).strip() or None
+
+
+# =========================
+# PIPELINE PAGE PAR PAGE
+# =========================
+
+def summarize_escalation(n_pages: int, escalated: List[Dict], stats: Dict, adaptive: bool) -> Dict:
+    """
+    Construit le bloc de statistiques d'escalade retourné avec l'analyse d'un document.
+    """
+    return {
+        "mode": "adaptatif" if adaptive else "fixe",
+        "pages": n_pages,
+        "pages_escaladees": escalated,
+        "taux_escalade": round(len(escalated) / n_pages, 3) if n_pages else 0.0,
+        "appels_llm": stats["appels_llm"],
+        "payload_octets": stats["payload_octets"],
+        "temps_inference_s": round(stats["temps_inference_s"], 3),
+        "prompt_tokens": stats["prompt_tokens"],
+        "completion_tokens": stats["completion_tokens"],
+    }
+
+
+def run_pages_concurrently(fn: Callable, items: Sequence) -> List:
+    """
+    Applique `fn` à chaque page en parallèle, résultats dans l'ordre des pages.
+    Les pages d'un document partent ensemble vers le backend (même prompt
+    système : regroupables en un lot) ; le budget d'inférence borne le total.
+    """
+    items = list(items)
+    if len(items) <= 1:
+        return [fn(item) for item in items]
+    with ThreadPoolExecutor(max_workers=len(items), thread_name_prefix="ocr-page") as pool:
+        # copy_context : les spans de chaque page restent rattachés à la trace de la requête
+        futures = [pool.submit(contextvars.copy_context().run, fn, item) for item in items]
+        return [f.result() for f in futures]
+
+
+def _keep_most_complete(missing_fields: Callable[[Dict], List[str]]) -> Callable[[Dict, Dict], Dict]:
+    def merge(low: Dict, high: Dict) -> Dict:
+        return high if len(missing_fields(high)) <= len(missing_fields(low)) else low
+    return merge
+
+
+def analyse_document_pages(
+    file_bytes: bytes,
+    filename: str,
+    lm_studio_url: str,
+    doc_type: str,
+    call_model: Callable[..., Dict],
+    missing_fields: Callable[[Dict], List[str]],
+    merge_escalated: Optional[Callable[[Dict, Dict], Dict]] = None,
+    pdf_scale: float = 2.0,
+    adaptive: bool = True,
+    prescreen: bool = True,
+    precompresse: bool = False,
+    page_indexes: Optional[Sequence[int]] = None,
+) -> Dict:
+    """
+    Pipeline commun des analyseurs page par page (CNI, passeport, permis) :
+    - PDF / image -> une image par page (basse résolution en mode adaptatif) ;
+      `page_indexes` restreint les pages PDF analysées
+    - pré-contrôle forensique (prescreen_document) avant tout appel LLM
+    - premier passage du modèle sur toutes les pages en parallèle :
+      call_model(image, lm_studio_base_url=..., jpeg_quality=..., stats=...)
+    - en mode adaptatif, ré-analyse haute résolution (pdf_scale, JPEG 90) des
+      seules pages où missing_fields(res) n'est pas vide, sauf si l'image haute
+      résolution est identique à celle déjà envoyée
+    - merge_escalated(basse, haute) : par défaut, le passage qui laisse le moins
+      de champs manquants
+
+    Retourne {"prescreen", "pages", "escalade"} ; "pages" vaut None si le
+    pré-contrôle rejette le document (à l'appelant de construire la réponse).
+    """
+    is_pdf = os.path.splitext(filename)[1].lower() == ".pdf"
+    merge_escalated = merge_escalated or _keep_most_complete(missing_fields)
+
+    # 1) PDF / image -> liste d'images
+    if is_pdf:
+        first_scale = ADAPTIVE_PDF_SCALE_LOW if adaptive else pdf_scale
+        pil_images = render_pdf_pages(file_bytes, scale=first_scale, page_indexes=page_indexes)
+        if not pil_images:
+            raise ValueError("Impossible de rendre le PDF en images.")
+        pdf_indexes = list(page_indexes) if page_indexes is not None else list(range(len(pil_images)))
+    else:
+        original_image = load_image(file_bytes)
+        if adaptive:
+            pil_images = [downscale_to_max_side(original_image, ADAPTIVE_IMAGE_MAX_SIDE_LOW)]
+        else:
+            pil_images = [original_image]
+
+    # 2) Pré-contrôle forensique local : rejet immédiat sans appel LLM
+    prescreen_report = None
+    if prescreen:
+        with span("prescreen"):
+            if is_pdf:
+                prescreen_report = prescreen_document(pil_images, resolution_scale=pdf_scale / first_scale)
+            else:
+                # signaux globaux sur l'image réduite du premier passage ; géométrie et ELA sur l'original
+                prescreen_report = prescreen_document(
+                    pil_images, source_bytes=file_bytes, ela=not precompresse, originals=[original_image]
+                )
+        if prescreen_report["verdict"] == "rejet":
+            print(f"### >>> Pré-contrôle {doc_type} '{filename}' : rejet {prescreen_report['motifs']}  <<< ###")
+            return {"prescreen": prescreen_report, "pages": None, "escalade": None}
+
+    # 3) Premier passage : toutes les pages soumises ensemble
+    stats = new_inference_stats(doc_type)
+    first_quality = ADAPTIVE_JPEG_QUALITY_LOW if adaptive else JPEG_QUALITY_HIGH
+
+    def first_pass(i: int) -> Dict:
+        with span("analyse_page", page=i + 1, passage="initial"):
+            return call_model(pil_images[i], lm_studio_base_url=lm_studio_url, jpeg_quality=first_quality, stats=stats)
+
+    results = run_pages_concurrently(first_pass, range(len(pil_images)))
+
+    # 4) Escalade en haute résolution des seules pages incomplètes, elles aussi ensemble
+    escalated: List[Dict] = []
+    if adaptive:
+        to_escalate = [(i, missing_fields(res)) for i, res in enumerate(results)]
+        to_escalate = [(i, missing) for i, missing in to_escalate if missing]
+
+        def escalate(item: Tuple[int, List[str]]) -> Optional[Dict]:
+            i, missing = item
+            with span("analyse_page", page=i + 1, passage="escalade", champs=",".join(missing)):
+                if is_pdf:
+                    high_img = render_pdf_pages(file_bytes, scale=pdf_scale, page_indexes=[pdf_indexes[i]])[0]
+                else:
+                    high_img = downscale_to_max_side(original_image, IMAGE_MAX_SIDE_HIGH)
+                if high_img.size == pil_images[i].size:
+                    # image source déjà sous le seuil basse résolution : mêmes pixels, pas d'escalade
+                    return None
+                return call_model(high_img, lm_studio_base_url=lm_studio_url, jpeg_quality=JPEG_QUALITY_HIGH, stats=stats)
+
+        for (i, missing), res_high in zip(to_escalate, run_pages_concurrently(escalate, to_escalate)):
+            if res_high is None:
+                continue
+            results[i] = merge_escalated(results[i], res_high)
+            escalated.append({"page": i + 1, "champs": missing})
+
+    escalation = summarize_escalation(len(pil_images), escalated, stats, adaptive)
+    print(f"### >>> Escalade {doc_type} '{filename}' : {escalation}  <<< ###")
+
+    return {"prescreen": prescreen_report, "pages": results, "escalade": escalation}
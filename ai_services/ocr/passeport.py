@@ -1,17 +1,22 @@
-import base64
-import io
 import json
-import os
-import tempfile
-from typing import List, Dict, Tuple
+from typing import List, Dict, Optional, Tuple
 from datetime import datetime
 import re
 
-import requests
 from PIL import Image
-import pypdfium2 as pdfium
 import pandas as pd
 
+from ai_services.analytics.prescreen import build_prescreen_rejection
+from ai_services.inference import post_chat_completion
+from ai_services.tracing import span
+from ai_services.utils import execution_timer
+from ai_services.ocr.pages import (
+    JPEG_QUALITY_HIGH,
+    analyse_document_pages,
+    parse_date,
+    pil_to_base64_jpeg,
+)
+
 
 # =========================
 # CONFIG LM STUDIO
@@ -40,46 +45,6 @@ PASSPORT_FIELDS = [
 ]
 
 
-# =========================
-# UTILITAIRES PDF -> IMAGES
-# =========================
-
-def pdf_bytes_to_pil_images(pdf_bytes: bytes, scale: float = 2.0) -> List[Image.Image]:
-    images: List[Image.Image] = []
-
-    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=False) as tmp:
-        tmp.write(pdf_bytes)
-        tmp_path = tmp.name
-
-    try:
-        pdf = pdfium.PdfDocument(tmp_path)
-        n_pages = len(pdf)
-
-        for i in range(n_pages):
-            page = pdf.get_page(i)
-            bitmap = page.render(scale=scale)
-            pil_image = bitmap.to_pil()
-            images.append(pil_image.convert("RGB"))
-            bitmap.close()
-            page.close()
-
-        pdf.close()
-    finally:
-        try:
-            if os.path.exists(tmp_path):
-                os.remove(tmp_path)
-        except PermissionError:
-            pass
-
-    return images
-
-
-def pil_to_base64_jpeg(img: Image.Image, quality: int = 90) -> str:
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=quality)
-    return base64.b64encode(buf.getvalue()).decode("utf-8")
-
-
 # =========================
 # PROMPT PASSEPORT
 # =========================
@@ -142,10 +107,16 @@ STRUCTURE DE RÉPONSE ATTENDUE :
 # APPEL LM STUDIO
 # =========================
 
-def call_lmstudio_vision_analyse_passport(pil_image: Image.Image, lm_studio_base_url: str) -> Dict:
+def call_lmstudio_vision_analyse_passport(
+    pil_image: Image.Image,
+    lm_studio_base_url: str,
+    jpeg_quality: int = JPEG_QUALITY_HIGH,
+    stats: Optional[Dict] = None,
+) -> Dict:
 
     system_prompt = build_passport_prompt()
-    img_b64 = pil_to_base64_jpeg(pil_image)
+    with span("encodage_jpeg", qualite=jpeg_quality):
+        img_b64 = pil_to_base64_jpeg(pil_image, quality=jpeg_quality)
 
     payload = {
         "model": LMSTUDIO_MODEL_ID,
@@ -170,18 +141,12 @@ def call_lmstudio_vision_analyse_passport(pil_image: Image.Image, lm_studio_base
         ]
     }
 
-    headers = {
-        "Authorization": f"Bearer {LMSTUDIO_API_KEY}",
-        "Content-Type": "application/json"
-    }
-
-    url = f"{lm_studio_base_url}/v1/chat/completions"
-    resp = requests.post(url, json=payload, headers=headers, timeout=120)
-
-    if resp.status_code != 200:
-        raise RuntimeError(f"Erreur LM Studio {resp.status_code} : {resp.text}")
-
-    data = resp.json()
+    data = post_chat_completion(
+        lm_studio_base_url,
+        payload,
+        api_key=LMSTUDIO_API_KEY,
+        stats=stats,
+    )
     content = data["choices"][0]["message"]["content"]
 
     # Parsing JSON
@@ -201,6 +166,33 @@ def call_lmstudio_vision_analyse_passport(pil_image: Image.Image, lm_studio_base
     return parsed
 
 
+# =========================
+# RÉSOLUTION ADAPTATIVE
+# =========================
+
+PASSPORT_REQUIRED_FIELDS = {
+    "donnees_titulaire": ["nom", "prenoms", "date_naissance"],
+    "donnees_document": ["passeport_no", "date_expiration"],
+}
+
+
+def passport_missing_fields(result: Dict) -> List[str]:
+    """
+    Liste les champs requis de la page biographique absents ou invalides
+    (dates non conformes au format dd/mm/yyyy comprises).
+    """
+    missing = []
+    for block, fields in PASSPORT_REQUIRED_FIELDS.items():
+        data = result.get(block) or {}
+        for f in fields:
+            val = data.get(f)
+            if val is None or val == "":
+                missing.append(f)
+            elif f.startswith("date_") and parse_date(val) is None:
+                missing.append(f)
+    return missing
+
+
 # =========================
 # SCORE D’AUTHENTICITÉ
 # =========================
@@ -213,46 +205,59 @@ def compute_passport_score(result: dict):
 # PIPELINE PRINCIPAL
 # =========================
 
+@execution_timer
 def analyse_passeport_file(
     file_bytes: bytes,
     filename: str,
     lm_studio_url: str,
     pdf_scale: float = 2.0,
     seuil_score: int = 75, 
-    doc_type: str = "Passeport"
+    doc_type: str = "Passeport",
+    adaptive: bool = True,
+    prescreen: bool = True,
+    precompresse: bool = False,
 ):
 
-    ext = os.path.splitext(filename)[1].lower()
-
-    # PDF → images
-    if ext == ".pdf":
-        pil_images = pdf_bytes_to_pil_images(file_bytes, scale=pdf_scale)
-        if not pil_images:
-            raise ValueError("Impossible de lire le PDF.")
-    else:
-        pil_images = [Image.open(io.BytesIO(file_bytes)).convert("RGB")]
-
-    # On analyse la page biographique
-    result = call_lmstudio_vision_analyse_passport(
-        pil_images[0],
-        lm_studio_base_url=lm_studio_url
+    # Seule la page biographique (première page d'un PDF) est analysée
+    analysis = analyse_document_pages(
+        file_bytes,
+        filename,
+        lm_studio_url,
+        doc_type,
+        call_model=call_lmstudio_vision_analyse_passport,
+        missing_fields=passport_missing_fields,
+        pdf_scale=pdf_scale,
+        adaptive=adaptive,
+        prescreen=prescreen,
+        precompresse=precompresse,
+        page_indexes=[0],
     )
-
-    
+    prescreen_report = analysis["prescreen"]
+    if analysis["pages"] is None:
+        return build_prescreen_rejection(
+            doc_type, prescreen_report, ["nom", "prenoms", "date_naissance", "numero_doc", "date_expiration"]
+        )
+    result = analysis["pages"][0]
+    escalation = analysis["escalade"]
+
+    titulaire = result.get("donnees_titulaire") or {}
+    document = result.get("donnees_document") or {}
     info =  {
-        "nom": result.get("donnees_titulaire").get("nom"), 
-        "prenoms": result.get("donnees_titulaire").get("prenoms"),
-        "date_naissance": result.get("donnees_titulaire").get("date_naissance"),
-        "numero_doc": result.get("donnees_document").get("passeport_no"),
-        "date_expiration": result.get("donnees_document").get("date_expiration")
+        "nom": titulaire.get("nom"), 
+        "prenoms": titulaire.get("prenoms"),
+        "date_naissance": titulaire.get("date_naissance"),
+        "nationalite": titulaire.get("nationalite"),
+        "numero_doc": document.get("passeport_no"),
+        "date_expiration": document.get("date_expiration")
     }
 
     return {
-            "rapport":None, 
+            "rapport": {"prescreen": prescreen_report}, 
             "score":99, 
             "type_document":doc_type,
             "date_analyse": f"{datetime.now().strftime("%d/%m/%Y")} à {datetime.now().strftime("%H:%M")}",
             "info":info, 
             "verification_number": 3,
-            "justify": None
+            "justify": None,
+            "escalade": escalation,
     }
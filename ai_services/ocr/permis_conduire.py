@@ -0,0 +1,307 @@
+import json
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from ai_services.analytics.prescreen import build_prescreen_rejection
+from ai_services.inference import post_chat_completion
+from ai_services.ocr.pages import (
+    JPEG_QUALITY_HIGH,
+    analyse_document_pages,
+    parse_date,
+    pil_to_base64_jpeg,
+)
+from ai_services.tracing import span
+from ai_services.utils import execution_timer
+
+
+# =========================
+# CONFIG LM STUDIO
+# =========================
+
+LMSTUDIO_API_KEY = "lm-studio"
+LMSTUDIO_MODEL_ID = "qwen3-vl-8b-instruct"   # adapte à ton modèle
+
+
+# =========================
+# CHAMPS PERMIS DE CONDUIRE
+# =========================
+
+RECTO_HINT_FIELDS = [
+    "numero_permis",
+    "nom",
+    "prenoms",
+    "date_naissance",
+    "lieu_naissance",
+    "nationalite",
+    "date_delivrance",
+    "date_expiration",
+    "autorite_delivrance",
+]
+
+VERSO_HINT_FIELDS = [
+    "categories",
+]
+
+PERMIS_FIELDS = ["face"] + RECTO_HINT_FIELDS + VERSO_HINT_FIELDS
+
+# Champs requis par face pour ne pas escalader en haute résolution
+RECTO_REQUIRED_FIELDS = ["numero_permis", "nom", "prenoms", "date_naissance", "date_delivrance"]
+VERSO_REQUIRED_FIELDS = ["categories"]
+
+AGE_MINIMUM_PERMIS = 16
+
+
+# =========================
+# PROMPT PERMIS
+# =========================
+
+def build_permis_prompt() -> str:
+    return """
+Tu es un expert des permis de conduire ivoiriens (format carte sécurisée).
+
+1) Détermine la face de la carte :
+   - RECTO : photo du titulaire, numéro du permis, nom, prénoms, dates.
+   - VERSO : tableau des catégories (A, B, C, D, E...) avec leurs dates.
+   - inconnu : si tu n'es pas sûr.
+   Remplis "face": "recto" | "verso" | "inconnu".
+
+2) Selon la face :
+- RECTO : remplis numero_permis, nom, prenoms, date_naissance, lieu_naissance,
+  nationalite, date_delivrance, date_expiration, autorite_delivrance
+  (laisse categories à null).
+- VERSO : remplis uniquement categories (liste des catégories obtenues,
+  ex : "A, B"), laisse les autres champs à null.
+- inconnu : laisse tous les champs à null.
+
+RAPPELS GÉNÉRAUX :
+- Si une information est absente ou illisible, mets la valeur à null.
+- Format des dates : "dd/mm/yyyy".
+- Réponds STRICTEMENT en JSON, sans texte autour.
+
+STRUCTURE DE RÉPONSE ATTENDUE :
+
+{
+    "face": "recto",
+    "numero_permis": "string ou null",
+    "nom": "string ou null",
+    "prenoms": "string ou null",
+    "date_naissance": "dd/mm/yyyy",
+    "lieu_naissance": "string ou null",
+    "nationalite": "string ou null",
+    "date_delivrance": "dd/mm/yyyy",
+    "date_expiration": "dd/mm/yyyy",
+    "autorite_delivrance": "string ou null",
+    "categories": "string ou null"
+}
+""".strip()
+
+
+# =========================
+# APPEL LM STUDIO
+# =========================
+
+def call_lmstudio_vision_analyse_permis(
+    pil_image: Image.Image,
+    lm_studio_base_url: str,
+    jpeg_quality: int = JPEG_QUALITY_HIGH,
+    stats: Optional[Dict] = None,
+) -> Dict:
+
+    system_prompt = build_permis_prompt()
+    with span("encodage_jpeg", qualite=jpeg_quality):
+        img_b64 = pil_to_base64_jpeg(pil_image, quality=jpeg_quality)
+
+    payload = {
+        "model": LMSTUDIO_MODEL_ID,
+        "temperature": 0.0,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "input_image",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{img_b64}"
+                        },
+                    },
+                    {
+                        "type": "text",
+                        "text": "Analyse ce permis de conduire et renvoie les champs demandés."
+                    }
+                ]
+            }
+        ]
+    }
+
+    data = post_chat_completion(
+        lm_studio_base_url,
+        payload,
+        api_key=LMSTUDIO_API_KEY,
+        stats=stats,
+    )
+    try:
+        content = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError) as e:
+        raise RuntimeError(f"Réponse inattendue de LM Studio: {data}") from e
+
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        parsed = {f: None for f in PERMIS_FIELDS}
+        parsed["face"] = "inconnu"
+        parsed["raw_response"] = content
+
+    for f in PERMIS_FIELDS:
+        if f not in parsed:
+            parsed[f] = None
+
+    if isinstance(parsed.get("categories"), list):
+        parsed["categories"] = ", ".join(str(c) for c in parsed["categories"])
+
+    face = (parsed.get("face") or "inconnu").lower()
+    if face not in ("recto", "verso", "inconnu"):
+        face = "inconnu"
+    parsed["face"] = face
+
+    return parsed
+
+
+# =========================
+# LOGIQUE MÉTIER PERMIS
+# =========================
+
+def permis_missing_fields(res: Dict) -> List[str]:
+    """
+    Champs requis (selon la face) absents ou invalides ; 'inconnu' -> ["face"].
+    """
+    face = res.get("face") or "inconnu"
+    if face == "recto":
+        required = RECTO_REQUIRED_FIELDS
+    elif face == "verso":
+        required = VERSO_REQUIRED_FIELDS
+    else:
+        return ["face"]
+
+    missing = []
+    for f in required:
+        val = res.get(f)
+        if val is None or val == "":
+            missing.append(f)
+        elif f.startswith("date_") and parse_date(val) is None:
+            missing.append(f)
+    return missing
+
+
+def fuse_permis_results(results: List[Dict]) -> Dict:
+    """
+    Fusionne recto et verso : champs du recto pris sur les pages recto,
+    catégories sur les pages verso ; en concurrence, la valeur la plus longue.
+    """
+    fused = {field: None for field in PERMIS_FIELDS}
+    faces = [r.get("face") for r in results]
+    fused["face"] = "recto" if "recto" in faces else ("verso" if "verso" in faces else "inconnu")
+
+    for res in results:
+        face = res.get("face")
+        if face == "recto":
+            fields = RECTO_HINT_FIELDS
+        elif face == "verso":
+            fields = VERSO_HINT_FIELDS
+        else:
+            continue
+
+        for field in fields:
+            val = res.get(field)
+            if val is None or val == "":
+                continue
+            if fused[field] is None or (isinstance(val, str) and len(val) > len(str(fused[field]))):
+                fused[field] = val
+
+    return fused
+
+
+def compute_permis_score(fused: Dict) -> int:
+    """
+    - numéro de permis présent
+    - date_expiration >= date_delivrance
+    - titulaire né avant aujourd'hui et âgé d'au moins 16 ans à la délivrance
+    """
+    score = 0
+
+    if fused.get("numero_permis"):
+        score += 40
+
+    d_del = parse_date(fused.get("date_delivrance"))
+    d_exp = parse_date(fused.get("date_expiration"))
+    if d_del is not None and d_exp is not None and d_exp >= d_del:
+        score += 30
+
+    d_birth = parse_date(fused.get("date_naissance"))
+    if d_birth is not None and d_birth < datetime.now():
+        if d_del is None or (d_del - d_birth).days >= AGE_MINIMUM_PERMIS * 365:
+            score += 30
+
+    return max(0, min(100, score))
+
+
+# =========================
+# PIPELINE PRINCIPAL
+# =========================
+
+@execution_timer
+def analyse_permis_file(
+    file_bytes: bytes,
+    filename: str,
+    lm_studio_url: str,
+    pdf_scale: float = 2.0,
+    seuil_score: int = 75,
+    doc_type: str = "Permis de Conduire",
+    adaptive: bool = True,
+    prescreen: bool = True,
+    precompresse: bool = False,
+):
+    """
+    Analyse un permis de conduire (PDF recto/verso ou image) : pipeline commun
+    analyse_document_pages (pré-contrôle, premier passage basse résolution,
+    escalade des seules pages incomplètes) puis fusion recto/verso.
+    """
+    analysis = analyse_document_pages(
+        file_bytes,
+        filename,
+        lm_studio_url,
+        doc_type,
+        call_model=call_lmstudio_vision_analyse_permis,
+        missing_fields=permis_missing_fields,
+        pdf_scale=pdf_scale,
+        adaptive=adaptive,
+        prescreen=prescreen,
+        precompresse=precompresse,
+    )
+    prescreen_report = analysis["prescreen"]
+    if analysis["pages"] is None:
+        return build_prescreen_rejection(
+            doc_type, prescreen_report, ["numero_doc"] + RECTO_HINT_FIELDS[1:] + VERSO_HINT_FIELDS
+        )
+    results = analysis["pages"]
+    escalation = analysis["escalade"]
+
+    fused = fuse_permis_results(results)
+    score = compute_permis_score(fused)
+
+    info = dict(fused)
+    info.pop("face")
+    info["numero_doc"] = info.pop("numero_permis")
+
+    return {
+            "rapport": {"prescreen": prescreen_report},
+            "score": score,
+            "type_document": doc_type,
+            "date_analyse": f"{datetime.now().strftime('%d/%m/%Y')} à {datetime.now().strftime('%H:%M')}",
+            "info": info,
+            "verification_number": 3,
+            "justify": "Permis de conduire conforme" if score >= seuil_score else "Document Non-Conforme !",
+            "escalade": escalation,
+    }
@@ -0,0 +1,399 @@
+import contextvars
+import json
+import os
+import re
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, as_completed, wait
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from PIL import Image
+
+from ai_services.inference import new_inference_stats, post_chat_completion
+from ai_services.ocr.pages import (
+    JPEG_QUALITY_HIGH,
+    iter_pdf_pages,
+    load_image,
+    normalize_text,
+    parse_date,
+    pil_to_base64_jpeg,
+)
+from ai_services.tracing import span
+from ai_services.utils import execution_timer
+
+
+# =========================
+# CONFIG LM STUDIO
+# =========================
+
+LMSTUDIO_API_KEY = "lm-studio"
+LMSTUDIO_MODEL_ID = "qwen3-vl-8b-instruct"   # adapte à ton modèle
+
+RCCM_MAX_WORKERS = int(os.getenv("OCR_RCCM_MAX_WORKERS", "4"))   # pages analysées en parallèle
+
+
+# =========================
+# CHAMPS RCCM
+# =========================
+
+RCCM_SCALAR_FIELDS = [
+    "denomination",
+    "numero_rccm",
+    "forme_juridique",
+    "capital",
+    "siege_social",
+    "activite",
+    "date_immatriculation",
+    "date_creation",
+]
+
+RCCM_FIELDS = RCCM_SCALAR_FIELDS + ["dirigeants"]
+
+# Format usuel OHADA : CI-ABJ-2019-B-12345 (ville, année, type, numéro)
+RCCM_NUMBER_PATTERN = re.compile(r"^[A-Z]{2}-[A-Z]{3}-(\d{2}|\d{4})-[A-Z]\d{0,2}-\d+$")
+
+
+# =========================
+# PROMPT RCCM
+# =========================
+
+def build_rccm_prompt() -> str:
+    return """
+Tu es un expert des extraits du Registre du Commerce et du Crédit Mobilier (RCCM)
+de l'espace OHADA, en particulier de Côte d'Ivoire.
+
+L'image est UNE page d'un extrait RCCM qui peut en compter plusieurs : elle ne
+contient en général qu'une partie des informations. Extrais uniquement ce qui
+figure sur CETTE page ; tout champ absent de la page doit valoir null.
+
+Champs attendus :
+- denomination : dénomination sociale ou nom commercial
+- numero_rccm : numéro d'immatriculation (ex : CI-ABJ-2019-B-12345)
+- forme_juridique : SARL, SA, SAS, entreprise individuelle, ...
+- capital : capital social avec sa devise (ex : "1 000 000 FCFA")
+- siege_social : adresse du siège
+- activite : activité principale
+- date_immatriculation : date d'immatriculation
+- date_creation : date de début d'activité / de constitution
+- dirigeants : liste des gérants, administrateurs ou associés visibles sur la page
+
+RAPPELS GÉNÉRAUX :
+- Format des dates : "dd/mm/yyyy".
+- Utilise des chaînes de caractères pour tous les champs sauf "dirigeants".
+- Réponds STRICTEMENT en JSON, sans texte autour.
+
+STRUCTURE DE RÉPONSE ATTENDUE :
+
+{
+    "denomination": "string ou null",
+    "numero_rccm": "string ou null",
+    "forme_juridique": "string ou null",
+    "capital": "string ou null",
+    "siege_social": "string ou null",
+    "activite": "string ou null",
+    "date_immatriculation": "dd/mm/yyyy ou null",
+    "date_creation": "dd/mm/yyyy ou null",
+    "dirigeants": [
+        {"nom": "string", "fonction": "string ou null"}
+    ]
+}
+""".strip()
+
+
+# =========================
+# APPEL LM STUDIO
+# =========================
+
+def call_lmstudio_vision_analyse_rccm(
+    pil_image: Image.Image,
+    lm_studio_base_url: str,
+    jpeg_quality: int = JPEG_QUALITY_HIGH,
+    stats: Optional[Dict] = None,
+) -> Dict:
+
+    system_prompt = build_rccm_prompt()
+    with span("encodage_jpeg", qualite=jpeg_quality):
+        img_b64 = pil_to_base64_jpeg(pil_image, quality=jpeg_quality)
+
+    payload = {
+        "model": LMSTUDIO_MODEL_ID,
+        "temperature": 0.0,
+        "messages": [
+            {"role": "system", "content": system_prompt},
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "input_image",
+                        "image_url": {
+                            "url": f"data:image/jpeg;base64,{img_b64}"
+                        },
+                    },
+                    {
+                        "type": "text",
+                        "text": "Extrais les informations RCCM présentes sur cette page."
+                    }
+                ]
+            }
+        ]
+    }
+
+    data = post_chat_completion(
+        lm_studio_base_url,
+        payload,
+        api_key=LMSTUDIO_API_KEY,
+        stats=stats,
+    )
+    try:
+        content = data["choices"][0]["message"]["content"]
+    except (KeyError, IndexError) as e:
+        raise RuntimeError(f"Réponse inattendue de LM Studio: {data}") from e
+
+    try:
+        parsed = json.loads(content)
+    except json.JSONDecodeError:
+        parsed = {f: None for f in RCCM_FIELDS}
+        parsed["raw_response"] = content
+
+    for f in RCCM_SCALAR_FIELDS:
+        if f not in parsed:
+            parsed[f] = None
+    if not isinstance(parsed.get("dirigeants"), list):
+        parsed["dirigeants"] = []
+
+    return parsed
+
+
+# =========================
+# FUSION INCRÉMENTALE
+# =========================
+
+def new_rccm_fusion() -> Dict:
+    """
+    État de fusion incrémentale : votes par champ et dirigeants dédoublonnés.
+    Chaque page est fusionnée dès que son analyse se termine (merge_rccm_page) ;
+    le résultat final ne dépend pas de l'ordre d'arrivée des pages.
+    """
+    return {
+        "votes": {f: Counter() for f in RCCM_SCALAR_FIELDS},
+        "valeurs": {f: {} for f in RCCM_SCALAR_FIELDS},   # clé normalisée -> (page, forme la plus longue)
+        "pages": {f: {} for f in RCCM_SCALAR_FIELDS},     # clé normalisée -> pages sources
+        "dirigeants": {},
+        "pages_fusionnees": 0,
+    }
+
+
+def merge_rccm_page(fusion: Dict, page_number: int, res: Dict) -> None:
+    """
+    Ajoute le résultat d'une page à l'état de fusion.
+    """
+    for field in RCCM_SCALAR_FIELDS:
+        val = res.get(field)
+        key = normalize_text(val)
+        if key is None:
+            continue
+        fusion["votes"][field][key] += 1
+        fusion["pages"][field].setdefault(key, []).append(page_number)
+        known = fusion["valeurs"][field].get(key)
+        candidate = (len(val.strip()), -page_number)
+        if known is None or candidate > (len(known[1]), -known[0]):
+            fusion["valeurs"][field][key] = (page_number, val.strip())
+
+    for person in res.get("dirigeants") or []:
+        if isinstance(person, str):
+            person = {"nom": person, "fonction": None}
+        if not isinstance(person, dict):
+            continue
+        name = person.get("nom")
+        key = normalize_text(name)
+        if key is None:
+            continue
+        known = fusion["dirigeants"].get(key)
+        if known is None or page_number < known["page"]:
+            fusion["dirigeants"][key] = {
+                "page": page_number,
+                "nom": name.strip(),
+                "fonction": person.get("fonction") or (known or {}).get("fonction"),
+            }
+        elif not known.get("fonction") and person.get("fonction"):
+            known["fonction"] = person.get("fonction")
+
+    fusion["pages_fusionnees"] += 1
+
+
+def finalize_rccm_fusion(fusion: Dict) -> Dict:
+    """
+    Résolution des conflits, dans l'esprit de fuse_cni_results :
+    - la valeur la plus fréquente entre les pages l'emporte
+    - à égalité, celle vue sur la page de plus petit numéro (indépendant de
+      l'ordre de fin des analyses)
+    Les champs en conflit sont listés avec leurs candidats et pages sources.
+    """
+    fused = {field: None for field in RCCM_FIELDS}
+    conflicts = {}
+
+    for field in RCCM_SCALAR_FIELDS:
+        votes = fusion["votes"][field]
+        if not votes:
+            continue
+        first_page = {k: min(fusion["pages"][field][k]) for k in votes}
+        best_key = max(votes, key=lambda k: (votes[k], -first_page[k]))
+        fused[field] = fusion["valeurs"][field][best_key][1]
+        if len(votes) > 1:
+            conflicts[field] = [
+                {"valeur": fusion["valeurs"][field][k][1], "pages": sorted(fusion["pages"][field][k])}
+                for k in sorted(votes, key=first_page.get)
+            ]
+
+    fused["dirigeants"] = [
+        {"nom": d["nom"], "fonction": d["fonction"]}
+        for d in sorted(fusion["dirigeants"].values(), key=lambda d: d["page"])
+    ]
+    fused["conflits"] = conflicts
+    return fused
+
+
+# =========================
+# SCORE
+# =========================
+
+def compute_rccm_score(fused: Dict) -> int:
+    """
+    - format du numéro RCCM
+    - date d'immatriculation valide et passée
+    - dénomination et au moins un dirigeant
+    """
+    score = 0
+
+    numero = (fused.get("numero_rccm") or "").replace(" ", "").upper()
+    if RCCM_NUMBER_PATTERN.match(numero):
+        score += 40
+
+    d_imm = parse_date(fused.get("date_immatriculation"))
+    if d_imm is not None and d_imm <= datetime.now():
+        score += 30
+        d_crea = parse_date(fused.get("date_creation"))
+        if d_crea is not None and d_crea > d_imm:
+            score -= 10
+
+    if fused.get("denomination") and fused.get("dirigeants"):
+        score += 30
+
+    return max(0, min(100, score))
+
+
+# =========================
+# PIPELINE PRINCIPAL
+# =========================
+
+@execution_timer
+def analyse_rccm_file(
+    file_bytes: bytes,
+    filename: str,
+    lm_studio_url: str,
+    pdf_scale: float = 2.0,
+    seuil_score: int = 75,
+    doc_type: str = "RCCM",
+    max_workers: int = RCCM_MAX_WORKERS,
+):
+    """
+    Analyse un extrait RCCM (PDF multi-pages ou image).
+
+    Pipeline :
+    - les pages du PDF sont rendues une à une (iter_pdf_pages)
+    - chaque page est soumise au modèle dès qu'elle est rendue, jusqu'à
+      `max_workers` pages en parallèle
+    - chaque résultat est fusionné dès son arrivée (merge_rccm_page), de sorte
+      que le document est prêt à peu près au temps de sa page la plus lente
+    - finalize_rccm_fusion résout les conflits entre pages
+    - une page en échec (erreur réseau, réponse illisible) est écartée du vote
+      et signalée dans le rapport (pages_en_echec) ; l'analyse n'échoue que si
+      aucune page n'a abouti
+    """
+    ext = os.path.splitext(filename)[1].lower()
+    stats = new_inference_stats(doc_type)
+    fusion = new_rccm_fusion()
+    n_pages = 0
+
+    if ext == ".pdf":
+        pages = iter_pdf_pages(file_bytes, scale=pdf_scale)
+    else:
+        pages = iter([(0, load_image(file_bytes))])
+
+    # Pas plus de 2 x max_workers pages rasterisées en attente d'analyse
+    max_pending = 2 * max_workers
+    pending = {}
+    failed = {}
+
+    def merge_done(done):
+        for future in done:
+            page = pending.pop(future)
+            try:
+                result = future.result()
+            except Exception as e:
+                print(f"### >>> RCCM '{filename}' : page {page} en échec ({e})  <<< ###")
+                failed[page] = e
+                continue
+            merge_rccm_page(fusion, page, result)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        while True:
+            # fusion des pages terminées pendant le rendu de la suivante
+            merge_done([f for f in pending if f.done()])
+            if len(pending) >= max_pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                merge_done(done)
+
+            item = next(pages, None)
+            if item is None:
+                break
+
+            i, img = item
+            # copy_context : les spans de la page restent rattachés à la trace de la requête
+            ctx = contextvars.copy_context()
+            future = pool.submit(
+                ctx.run,
+                call_lmstudio_vision_analyse_rccm,
+                img,
+                lm_studio_url,
+                JPEG_QUALITY_HIGH,
+                stats,
+            )
+            pending[future] = i + 1
+            n_pages += 1
+
+        if n_pages == 0:
+            raise ValueError("Impossible de lire le PDF.")
+
+        merge_done(as_completed(list(pending)))
+
+    if len(failed) == n_pages:
+        raise failed[min(failed)]
+
+    fused = finalize_rccm_fusion(fusion)
+    score = compute_rccm_score(fused)
+    print(f"### >>> RCCM '{filename}' : {n_pages} pages, {stats}  <<< ###")
+
+    info = {
+        "nom": fused.get("denomination"),
+        "prenoms": None,
+        "date_naissance": None,
+        "numero_doc": fused.get("numero_rccm"),
+        "date_expiration": None,
+        **{f: fused.get(f) for f in RCCM_FIELDS if f not in ("denomination", "numero_rccm")},
+    }
+
+    return {
+            "rapport": {
+                "conflits": fused["conflits"],
+                "pages": n_pages,
+                "pages_en_echec": sorted(failed),
+                "inference": stats,
+            },
+            "score": score,
+            "type_document": doc_type,
+            "date_analyse": f"{datetime.now().strftime('%d/%m/%Y')} à {datetime.now().strftime('%H:%M')}",
+            "info": info,
+            "verification_number": 3,
+            "justify": "Extrait RCCM conforme" if score >= seuil_score else "Document Non-Conforme !",
+    }
@@ -0,0 +1,223 @@
+""" Sessions d'analyse CNI : recto et verso envoyés séparément, fusionnés au fil de l'eau """
+import os
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from ai_services.ocr import cni
+from ai_services.shared_state import SHARED_STATE, SHARED_STATE_ENABLED
+from ai_services.utils import execution_timer
+
+
+# =========================
+# CONFIG
+# =========================
+
+SESSION_TTL_S = int(os.getenv("OCR_SESSION_TTL_S", "1800"))     # session oubliée après 30 min d'inactivité
+SESSION_MAX = int(os.getenv("OCR_SESSION_MAX", "1000"))          # au-delà, les plus anciennes sont évincées
+
+
+# =========================
+# STOCKAGE
+# =========================
+
+class SessionStore:
+    """
+    Sessions en mémoire du processus, indexées par identifiant.
+    L'analyse d'une page se fait hors verrou ; seule la fusion dans la session est sérialisée.
+    """
+
+    def __init__(self, ttl_s: int = SESSION_TTL_S, max_sessions: int = SESSION_MAX):
+        self.ttl_s = ttl_s
+        self.max_sessions = max_sessions
+        self._sessions: Dict[str, Dict] = {}
+        self._lock = threading.Lock()
+
+    def create(self, doc_type: str) -> str:
+        session_id = secrets.token_hex(12)
+        now = time.time()
+        with self._lock:
+            self._purge(now)
+            self._sessions[session_id] = {
+                "session_id": session_id,
+                "type_document": doc_type,
+                "pages": [],
+                "envois": [],
+                "fusion": _fuse_session_pages([]),
+                "cree_le": now,
+                "maj_le": now,
+            }
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        with self._lock:
+            self._purge(time.time())
+            session = self._sessions.get(session_id)
+            return _snapshot(session) if session else None
+
+    def append(self, session_id: str, pages: List[Dict], envoi: Dict) -> Optional[Dict]:
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                return None
+            session["pages"].extend(pages)
+            session["envois"].append(envoi)
+            if pages:
+                session["fusion"] = _fuse_session_pages(session["pages"])
+            session["maj_le"] = time.time()
+            return _snapshot(session)
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            return self._sessions.pop(session_id, None) is not None
+
+    def _purge(self, now: float):
+        expired = [k for k, s in self._sessions.items() if now - s["maj_le"] > self.ttl_s]
+        for k in expired:
+            del self._sessions[k]
+        if len(self._sessions) >= self.max_sessions:
+            oldest = sorted(self._sessions, key=lambda k: self._sessions[k]["maj_le"])
+            for k in oldest[: len(self._sessions) - self.max_sessions + 1]:
+                del self._sessions[k]
+
+
+def _fuse_session_pages(pages: List[Dict]) -> Dict:
+    """
+    Fusion et score des pages reçues, recalculés uniquement quand une page
+    s'ajoute : le score (qui comporte une part aléatoire) reste stable d'une
+    lecture à l'autre de la session.
+    """
+    if not pages:
+        return {"info": None, "score": 0}
+    info, score = cni.fuse_and_score_cni([p["resultat"] for p in pages])
+    return {"info": info, "score": score}
+
+
+def _snapshot(session: Dict) -> Dict:
+    return {
+        **session,
+        "pages": [dict(p) for p in session["pages"]],
+        "envois": [dict(e) for e in session["envois"]],
+    }
+
+
+class SharedSessionStore:
+    """
+    Même interface que SessionStore, stockée dans le cache inter-processus :
+    en mode multi-workers, le recto et le verso peuvent arriver sur deux
+    workers différents. L'ajout de pages est atomique (cache_update).
+    """
+
+    def __init__(self, ttl_s: int = SESSION_TTL_S):
+        self.ttl_s = ttl_s
+
+    @staticmethod
+    def _key(session_id: str) -> str:
+        return f"session_cni:{session_id}"
+
+    def create(self, doc_type: str) -> str:
+        session_id = secrets.token_hex(12)
+        now = time.time()
+        SHARED_STATE.cache_set(self._key(session_id), {
+            "session_id": session_id,
+            "type_document": doc_type,
+            "pages": [],
+            "envois": [],
+            "fusion": _fuse_session_pages([]),
+            "cree_le": now,
+            "maj_le": now,
+        }, self.ttl_s)
+        return session_id
+
+    def get(self, session_id: str) -> Optional[Dict]:
+        return SHARED_STATE.cache_get(self._key(session_id))
+
+    def append(self, session_id: str, pages: List[Dict], envoi: Dict) -> Optional[Dict]:
+        def add(session):
+            session["pages"].extend(pages)
+            session["envois"].append(envoi)
+            if pages:
+                session["fusion"] = _fuse_session_pages(session["pages"])
+            session["maj_le"] = time.time()
+            return session
+        return SHARED_STATE.cache_update(self._key(session_id), add, self.ttl_s)
+
+    def delete(self, session_id: str) -> bool:
+        return SHARED_STATE.cache_delete(self._key(session_id))
+
+
+SESSION_STORE = SharedSessionStore() if SHARED_STATE_ENABLED else SessionStore()
+
+
+# =========================
+# LOGIQUE MÉTIER
+# =========================
+
+def build_session_result(session: Dict) -> Dict:
+    """
+    Résultat courant de la session : fusion de toutes les pages reçues,
+    stockée à chaque ajout de page (_fuse_session_pages), sans nouvelle
+    inférence ni nouveau score. Un envoi rejeté par le pré-contrôle
+    forensique rend toute la session non conforme.
+    """
+    pages = [p["resultat"] for p in session["pages"]]
+    rejets = [e for e in session["envois"] if e.get("rejet")]
+
+    info, score = session["fusion"]["info"], session["fusion"]["score"]
+    if rejets:
+        score = 0
+
+    faces = sorted({p.get("face") for p in pages} - {None, "inconnu"})
+    return {
+        "session_id": session["session_id"],
+        "score": score,
+        "type_document": session["type_document"],
+        "date_analyse": f"{datetime.now().strftime('%d/%m/%Y')} à {datetime.now().strftime('%H:%M')}",
+        "info": info,
+        "faces_recues": faces,
+        "complet": faces == ["recto", "verso"],
+        "envois": session["envois"],
+        "justify": "Document Non-Conforme !" if rejets or score < 75 else "Document acceptable",
+    }
+
+
+@execution_timer
+def analyse_cni_session_file(session_id: str, file_bytes: bytes, filename: str,
+                             lm_studio_url: str, adaptive: bool = True,
+                             precompresse: bool = False) -> Optional[Dict]:
+    """
+    Analyse uniquement le nouveau fichier puis le fusionne aux pages déjà
+    reçues par la session. Retourne None si la session n'existe pas (ou plus).
+    """
+    if SESSION_STORE.get(session_id) is None:
+        return None
+
+    analysis = cni.analyse_cni_file(
+        file_bytes=file_bytes,
+        filename=filename,
+        pdf_scale=2.0,
+        lm_studio_url=lm_studio_url,
+        adaptive=adaptive,
+        precompresse=precompresse,
+    )
+
+    pages = [
+        {"fichier": filename, "page": i + 1, "resultat": res}
+        for i, res in enumerate(analysis.get("pages") or [])
+    ]
+    prescreen = (analysis.get("rapport") or {}).get("prescreen") or {}
+    envoi = {
+        "fichier": filename,
+        "faces": [p["resultat"].get("face") for p in pages],
+        "rejet": prescreen.get("verdict") == "rejet",
+        "rapport": analysis.get("rapport"),
+        "escalade": analysis.get("escalade"),
+    }
+
+    session = SESSION_STORE.append(session_id, pages, envoi)
+    if session is None:
+        return None
+    print(f"### >>> Session CNI {session_id} : {len(session['pages'])} pages, envoi '{filename}' {envoi['faces']}  <<< ###")
+    return build_session_result(session)
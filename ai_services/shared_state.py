@@ -0,0 +1,311 @@
+""" État partagé entre processus workers (cache, budget d'inférence, métriques) via une base SQLite locale """
+import json
+import os
+import random
+import sqlite3
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:                           # Windows : pas de mode multi-workers (gunicorn), budget en mémoire
+    fcntl = None
+
+
+# =========================
+# CONFIG
+# =========================
+
+# Activé par le mode production multi-workers (gunicorn_conf.py) ; en mode
+# développement (un seul processus) l'état reste en mémoire.
+SHARED_STATE_ENABLED = os.getenv("OCR_SHARED_STATE", "0") == "1"
+SHARED_STATE_DB = os.getenv("OCR_SHARED_STATE_DB", os.path.join("run", "etat_partage.sqlite3"))
+
+_WAIT_MIN_S = 0.001                           # tête de file d'attente d'un jeton : 1 ms puis backoff
+_WAIT_MAX_S = 0.02
+
+_SCHEMA = [
+    """CREATE TABLE IF NOT EXISTS cache (
+        cle TEXT PRIMARY KEY,
+        valeur TEXT NOT NULL,
+        expire_le REAL NOT NULL
+    )""",
+    """CREATE TABLE IF NOT EXISTS compteurs (
+        nom TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        valeur REAL NOT NULL,
+        PRIMARY KEY (nom, pid)
+    )""",
+    """CREATE TABLE IF NOT EXISTS jauges (
+        nom TEXT NOT NULL,
+        pid INTEGER NOT NULL,
+        valeur REAL NOT NULL,
+        maj_le REAL NOT NULL,
+        PRIMARY KEY (nom, pid)
+    )""",
+]
+
+
+def _pid_alive(pid: int) -> bool:
+    if os.name != "posix":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# =========================
+# BASE PARTAGÉE
+# =========================
+
+class SharedState:
+    """
+    Une connexion SQLite par thread et par processus (l'application est
+    préchargée puis forkée : une connexion ouverte avant le fork n'est jamais
+    réutilisée). Les lectures-modifications-écritures passent par des
+    transactions BEGIN IMMEDIATE, sérialisées entre processus par SQLite.
+    """
+
+    def __init__(self, path: str = SHARED_STATE_DB):
+        self.path = path
+        self._local = threading.local()
+        self._schema_ready = False
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is not None and self._local.pid == os.getpid():
+            return conn
+
+        if os.path.dirname(self.path):
+            os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=10.0, isolation_level=None)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        if not self._schema_ready:
+            for statement in _SCHEMA:
+                conn.execute(statement)
+            self._schema_ready = True
+        self._local.conn = conn
+        self._local.pid = os.getpid()
+        return conn
+
+    @contextmanager
+    def _transaction(self):
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    # ---- cache clé / valeur (JSON) avec expiration ----
+
+    def cache_get(self, key: str) -> Optional[Any]:
+        row = self._connection().execute(
+            "SELECT valeur FROM cache WHERE cle = ? AND expire_le > ?", (key, time.time())
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def cache_set(self, key: str, value: Any, ttl_s: float) -> None:
+        now = time.time()
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM cache WHERE expire_le <= ?", (now,))
+            conn.execute(
+                "INSERT OR REPLACE INTO cache (cle, valeur, expire_le) VALUES (?, ?, ?)",
+                (key, json.dumps(value, ensure_ascii=False), now + ttl_s),
+            )
+
+    def cache_update(self, key: str, fn: Callable[[Any], Any], ttl_s: float) -> Optional[Any]:
+        """
+        Applique `fn` à la valeur courante de façon atomique entre processus.
+        Retourne la nouvelle valeur, ou None si la clé est absente ou expirée.
+        """
+        now = time.time()
+        with self._transaction() as conn:
+            row = conn.execute(
+                "SELECT valeur FROM cache WHERE cle = ? AND expire_le > ?", (key, now)
+            ).fetchone()
+            if row is None:
+                return None
+            value = fn(json.loads(row[0]))
+            conn.execute(
+                "UPDATE cache SET valeur = ?, expire_le = ? WHERE cle = ?",
+                (json.dumps(value, ensure_ascii=False), now + ttl_s, key),
+            )
+        return value
+
+    def cache_delete(self, key: str) -> bool:
+        with self._transaction() as conn:
+            return conn.execute("DELETE FROM cache WHERE cle = ?", (key,)).rowcount > 0
+
+    # ---- compteurs cumulés (une ligne par processus, sommés à la lecture) ----
+
+    def counters_add(self, values: Dict[str, float]) -> None:
+        pid = os.getpid()
+        with self._transaction() as conn:
+            conn.executemany(
+                "INSERT INTO compteurs (nom, pid, valeur) VALUES (?, ?, ?) "
+                "ON CONFLICT (nom, pid) DO UPDATE SET valeur = valeur + excluded.valeur",
+                [(name, pid, delta) for name, delta in values.items()],
+            )
+
+    def counters(self, prefix: str = "") -> Dict[str, float]:
+        rows = self._connection().execute(
+            "SELECT nom, SUM(valeur) FROM compteurs WHERE nom LIKE ? GROUP BY nom", (prefix + "%",)
+        ).fetchall()
+        return {name[len(prefix):]: value for name, value in rows}
+
+    # ---- jauges (valeur instantanée par processus) ----
+
+    def gauge_set(self, name: str, value: float) -> None:
+        self._connection().execute(
+            "INSERT OR REPLACE INTO jauges (nom, pid, valeur, maj_le) VALUES (?, ?, ?, ?)",
+            (name, os.getpid(), value, time.time()),
+        )
+
+    def gauges(self, name: str) -> Dict[int, float]:
+        rows = self._connection().execute(
+            "SELECT pid, valeur FROM jauges WHERE nom = ?", (name,)
+        ).fetchall()
+        return {pid: value for pid, value in rows if _pid_alive(pid)}
+
+    # ---- cycle de vie ----
+
+    def release_process(self, pid: int) -> None:
+        """
+        Efface les jauges d'un worker terminé (appelé par le maître gunicorn).
+        Ses jetons de budget (verrous de fichiers) sont rendus par le noyau.
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jauges WHERE pid = ?", (pid,))
+
+    def reset(self) -> None:
+        """
+        Repart d'un état propre au démarrage du maître : jauges et compteurs
+        d'une exécution précédente sont effacés, le cache est conservé.
+        """
+        with self._transaction() as conn:
+            conn.execute("DELETE FROM jauges")
+            conn.execute("DELETE FROM compteurs")
+
+
+SHARED_STATE = SharedState()
+
+
+# =========================
+# BUDGET INTER-PROCESSUS
+# =========================
+
+class SharedSemaphore:
+    """
+    Sémaphore borné commun à tous les workers, même interface que
+    threading.BoundedSemaphore. Chaque jeton est un fichier verrou
+    (run/<nom>.<i>.lock) pris par flock : les jetons d'un worker tué sont
+    rendus automatiquement à la fermeture de ses descripteurs.
+
+    Sans jeton libre, les demandeurs se rangent derrière un verrou de file
+    d'attente (run/<nom>.attente.lock) servi par le noyau : seul le premier
+    de la file scrute tous les jetons, avec un court backoff, et prend le
+    premier rendu quel qu'il soit.
+
+    Les jetons du processus sont interchangeables : un jeton pris par un
+    thread peut être rendu par un autre (lots du MicroBatcher).
+    """
+
+    def __init__(self, name: str, size: int, state: SharedState = SHARED_STATE):
+        self.name = name
+        self.size = max(1, size)
+        self.state = state
+        directory = os.path.dirname(state.path) or "."
+        self._slots = [os.path.join(directory, f"{name}.{i}.lock") for i in range(self.size)]
+        self._lot_path = os.path.join(directory, f"{name}.lot.lock")
+        self._queue_path = os.path.join(directory, f"{name}.attente.lock")
+        self._held: List[Tuple[int, str]] = []
+        self._cond = threading.Condition()
+
+    @staticmethod
+    def _open(path: str) -> int:
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        return os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+
+    def _try_acquire(self) -> bool:
+        """
+        Tentative non bloquante sur les jetons que ce processus ne détient pas (sous self._cond).
+        Un descripteur par prise : flock exclut aussi deux threads du même processus.
+        """
+        held = {path for _, path in self._held}
+        others = [path for path in self._slots if path not in held]
+        random.shuffle(others)
+        for path in others:
+            fd = self._open(path)
+            try:
+                fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                os.close(fd)
+                continue
+            self._held.append((fd, path))
+            self._publish_in_use()
+            return True
+        return False
+
+    def acquire(self) -> bool:
+        with self._cond:
+            if self._try_acquire():
+                return True
+
+        queue_fd = self._open(self._queue_path)
+        try:
+            fcntl.flock(queue_fd, fcntl.LOCK_EX)
+            delay = _WAIT_MIN_S
+            with self._cond:
+                while not self._try_acquire():
+                    # réveil immédiat sur un release() local, sinon nouvelle scrutation
+                    self._cond.wait(delay)
+                    delay = min(_WAIT_MAX_S, delay * 2)
+            return True
+        finally:
+            os.close(queue_fd)
+
+    def acquire_many(self, n: int) -> None:
+        """
+        Prend n jetons d'un bloc (lot du MicroBatcher). Une seule prise groupée
+        à la fois entre workers : deux lots partiellement servis ne peuvent pas
+        s'attendre mutuellement.
+        """
+        fd = self._open(self._lot_path)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX)
+            for _ in range(n):
+                self.acquire()
+        finally:
+            os.close(fd)
+
+    def release(self) -> None:
+        with self._cond:
+            fd, _ = self._held.pop()
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+            self._publish_in_use()
+            self._cond.notify()
+
+    def _publish_in_use(self) -> None:
+        # sous self._cond : les valeurs publiées suivent l'ordre des prises et des rendus
+        try:
+            self.state.gauge_set(f"budget.{self.name}", len(self._held))
+        except sqlite3.Error as e:
+            print(f"### >>> Jauge du budget '{self.name}' non publiée : {e}  <<< ###")
+
+    def in_use(self) -> int:
+        """
+        Jetons pris par l'ensemble des workers vivants (jauges publiées à chaque prise / rendu).
+        """
+        return int(sum(self.state.gauges(f"budget.{self.name}").values()))
@@ -0,0 +1,349 @@
+""" Traces à la demande (spans imbriqués, export OTLP/JSON local) et profil CPU échantillonné """
+import json
+import os
+import random
+import secrets
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager, nullcontext
+from contextvars import ContextVar
+from typing import Dict, List, Optional
+
+
+# =========================
+# CONFIG
+# =========================
+
+TRACE_EXPORT_DIR = os.getenv("OCR_TRACE_DIR", "traces")
+TRACE_EXPORT_FILE = os.path.join(TRACE_EXPORT_DIR, "spans.jsonl")
+PROFILE_EXPORT_DIR = os.path.join(TRACE_EXPORT_DIR, "profiles")
+
+# Rotation : spans.jsonl -> spans.jsonl.1 -> ... au-delà de la taille max,
+# profils supprimés au-delà du nombre max ou de l'âge max.
+TRACE_EXPORT_MAX_BYTES = int(float(os.getenv("OCR_TRACE_MAX_MB", "64")) * 1024 * 1024)
+TRACE_EXPORT_BACKUPS = int(os.getenv("OCR_TRACE_BACKUPS", "2"))
+PROFILE_MAX_FILES = int(os.getenv("OCR_PROFILE_MAX_FILES", "200"))
+PROFILE_MAX_AGE_S = int(os.getenv("OCR_PROFILE_MAX_AGE_S", str(7 * 24 * 3600)))
+
+TRACE_HEADER = "x-ocr-trace"                 # "1" -> trace, "profile" -> trace + profil CPU
+TRACE_SAMPLE_RATE = float(os.getenv("OCR_TRACE_SAMPLE_RATE", "0"))
+PROFILE_SAMPLE_RATE = float(os.getenv("OCR_PROFILE_SAMPLE_RATE", "0"))
+PROFILE_INTERVAL_S = 0.005
+
+SERVICE_NAME = "fraud-analysis-ocr"
+
+_current_trace: ContextVar[Optional["Trace"]] = ContextVar("ocr_trace", default=None)
+_current_span: ContextVar[Optional["Span"]] = ContextVar("ocr_span", default=None)
+
+# Un seul objet partagé quand la trace est inactive : aucun coût hors lecture du ContextVar
+_NOOP_SPAN = nullcontext()
+_export_lock = threading.Lock()
+
+
+# =========================
+# SPANS
+# =========================
+
+class Span:
+
+    def __init__(self, trace: "Trace", name: str, parent_id: Optional[str], attributes: Dict):
+        self.trace = trace
+        self.name = name
+        self.span_id = secrets.token_hex(8)
+        self.parent_id = parent_id
+        self.attributes = dict(attributes)
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.error: Optional[str] = None
+
+    def set_attribute(self, key: str, value) -> None:
+        self.attributes[key] = value
+
+    def to_otlp(self) -> Dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": 1,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or time.time_ns()),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": 2, "message": self.error} if self.error else {"code": 1},
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+class Trace:
+
+    def __init__(self, name: str, profile: bool = False):
+        self.trace_id = secrets.token_hex(16)
+        self.name = name
+        self.spans: List[Span] = []
+        self.thread_ids = {threading.get_ident()}
+        self.profiler = SamplingProfiler(self) if profile else None
+        self._lock = threading.Lock()
+
+    def add(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+            self.thread_ids.add(threading.get_ident())
+
+
+def _otlp_attribute(key: str, value) -> Dict:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+@contextmanager
+def _record_span(trace: Trace, name: str, attributes: Dict):
+    parent = _current_span.get()
+    current = Span(trace, name, parent.span_id if parent else None, attributes)
+    trace.add(current)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.error = f"{type(e).__name__}: {e}"
+        raise
+    finally:
+        current.end_ns = time.time_ns()
+        _current_span.reset(token)
+
+
+def span(name: str, **attributes):
+    """
+    Ouvre un span enfant du span courant si une trace est active pour la requête.
+    Sans trace active, retourne un context manager partagé qui ne fait rien.
+
+        with span("rendu_pdf", pages=3) as s:
+            ...
+            if s is not None:
+                s.set_attribute("octets", n)
+    """
+    trace = _current_trace.get()
+    if trace is None:
+        return _NOOP_SPAN
+    return _record_span(trace, name, attributes)
+
+
+def tracing_active() -> bool:
+    return _current_trace.get() is not None
+
+
+# =========================
+# CYCLE DE VIE D'UNE TRACE
+# =========================
+
+def should_trace(header_value: Optional[str]):
+    """
+    Décide si une requête est tracée et/ou profilée.
+    Retourne (trace: bool, profile: bool).
+    """
+    if header_value:
+        value = header_value.strip().lower()
+        if value == "profile":
+            return True, True
+        if value in ("1", "true", "on", "trace"):
+            return True, False
+
+    if PROFILE_SAMPLE_RATE and random.random() < PROFILE_SAMPLE_RATE:
+        return True, True
+    if TRACE_SAMPLE_RATE and random.random() < TRACE_SAMPLE_RATE:
+        return True, False
+    return False, False
+
+
+def start_trace(name: str, profile: bool = False, **attributes):
+    """
+    Démarre une trace pour la requête courante et ouvre son span racine.
+    Retourne un jeton à passer à end_trace.
+    """
+    trace = Trace(name, profile=profile)
+    trace_token = _current_trace.set(trace)
+    root_cm = _record_span(trace, name, attributes)
+    root = root_cm.__enter__()
+    if trace.profiler is not None:
+        trace.profiler.start()
+    return trace, trace_token, root_cm, root
+
+
+def end_trace(token, error: Optional[BaseException] = None) -> Trace:
+    """
+    Ferme le span racine et arrête le profil éventuel. Aucune écriture
+    disque ici : l'appelant exporte ensuite la trace (export_trace), hors
+    boucle d'événements.
+    """
+    trace, trace_token, root_cm, root = token
+    if error is not None:
+        root.error = f"{type(error).__name__}: {error}"
+    root_cm.__exit__(None, None, None)
+    _current_trace.reset(trace_token)
+
+    if trace.profiler is not None:
+        trace.profiler.stop()
+    return trace
+
+
+# =========================
+# EXPORT OTLP/JSON
+# =========================
+
+def export_trace(trace: Trace) -> None:
+    """
+    Ajoute la trace au fichier d'export, une ligne par trace au format
+    OTLP/JSON (ExportTraceServiceRequest), relisible par un collecteur
+    OpenTelemetry (receiver otlpjsonfile) ou Jaeger. Écrit aussi le profil
+    CPU si la requête était profilée. Bloquant : à appeler hors boucle d'événements.
+    """
+    if trace.profiler is not None:
+        trace.profiler.export()
+
+    record = {
+        "resourceSpans": [{
+            "resource": {"attributes": [
+                _otlp_attribute("service.name", SERVICE_NAME),
+                _otlp_attribute("process.pid", os.getpid()),
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "ai_services.tracing"},
+                "spans": [s.to_otlp() for s in trace.spans],
+            }],
+        }]
+    }
+    line = json.dumps(record, ensure_ascii=False)
+
+    os.makedirs(TRACE_EXPORT_DIR, exist_ok=True)
+    with _export_lock:
+        _rotate_export_file(len(line) + 1)
+        with open(TRACE_EXPORT_FILE, "a", encoding="utf-8") as f:
+            f.write(line + "\n")
+
+
+def _export_files() -> List[str]:
+    """
+    Fichier courant puis sauvegardes, du plus récent au plus ancien.
+    """
+    return [TRACE_EXPORT_FILE] + [f"{TRACE_EXPORT_FILE}.{i}" for i in range(1, TRACE_EXPORT_BACKUPS + 1)]
+
+
+def _rotate_export_file(incoming: int) -> None:
+    try:
+        size = os.path.getsize(TRACE_EXPORT_FILE)
+    except OSError:
+        return
+    if size + incoming <= TRACE_EXPORT_MAX_BYTES:
+        return
+
+    files = _export_files()
+    if TRACE_EXPORT_BACKUPS <= 0:
+        os.remove(TRACE_EXPORT_FILE)
+        return
+    for src, dst in reversed(list(zip(files[:-1], files[1:]))):
+        if os.path.exists(src):
+            os.replace(src, dst)
+
+
+def find_trace(trace_id: str) -> Optional[Dict]:
+    """
+    Relit les fichiers d'export (courant puis sauvegardes) et retourne
+    l'enregistrement OTLP d'une trace. Bloquant : à appeler hors boucle d'événements.
+    """
+    for path in _export_files():
+        if not os.path.exists(path):
+            continue
+        with open(path, encoding="utf-8") as f:
+            for line in f:
+                if trace_id in line:
+                    record = json.loads(line)
+                    spans = record["resourceSpans"][0]["scopeSpans"][0]["spans"]
+                    if spans and spans[0]["traceId"] == trace_id:
+                        return record
+    return None
+
+
+def profile_path(trace_id: str) -> str:
+    return os.path.join(PROFILE_EXPORT_DIR, f"{trace_id}.folded")
+
+
+# =========================
+# PROFIL CPU ÉCHANTILLONNÉ
+# =========================
+
+class SamplingProfiler:
+    """
+    Profileur par échantillonnage : un thread lit périodiquement la pile des
+    threads ayant travaillé pour la trace (sys._current_frames) et compte les
+    piles repliées. Export au format "folded" (flamegraph.pl, speedscope).
+    """
+
+    def __init__(self, trace: Trace, interval: float = PROFILE_INTERVAL_S):
+        self.trace = trace
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="ocr-profiler", daemon=True)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self) -> None:
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            frames = sys._current_frames()
+            for thread_id in list(self.trace.thread_ids):
+                frame = frames.get(thread_id)
+                if frame is None or thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                self.samples[";".join(reversed(stack))] += 1
+
+    def export(self) -> str:
+        os.makedirs(PROFILE_EXPORT_DIR, exist_ok=True)
+        path = profile_path(self.trace.trace_id)
+        with open(path, "w", encoding="utf-8") as f:
+            for stack, count in self.samples.most_common():
+                f.write(f"{stack} {count}\n")
+        prune_profiles()
+        return path
+
+
+def prune_profiles() -> int:
+    """
+    Supprime les profils plus anciens que PROFILE_MAX_AGE_S et les plus
+    anciens au-delà de PROFILE_MAX_FILES. Retourne le nombre supprimé.
+    """
+    try:
+        entries = [e for e in os.scandir(PROFILE_EXPORT_DIR) if e.name.endswith(".folded")]
+    except OSError:
+        return 0
+
+    entries.sort(key=lambda e: e.stat().st_mtime, reverse=True)
+    cutoff = time.time() - PROFILE_MAX_AGE_S
+    removed = 0
+    for rank, entry in enumerate(entries):
+        if rank >= PROFILE_MAX_FILES or entry.stat().st_mtime < cutoff:
+            try:
+                os.remove(entry.path)
+                removed += 1
+            except OSError:
+                pass                          # déjà supprimé par un autre worker
+    return removed
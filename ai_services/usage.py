@@ -0,0 +1,182 @@
+""" Comptabilité d'usage de l'inférence (tokens, octets, temps) agrégée dans une base SQLite locale """
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, List, Optional
+
+
+# =========================
+# CONFIG
+# =========================
+
+USAGE_DB_PATH = os.getenv("OCR_USAGE_DB", os.path.join("usage", "usage.sqlite3"))
+USAGE_BUCKET_S = int(os.getenv("OCR_USAGE_BUCKET_S", "60"))     # granularité du cumul (1 ligne / minute / dimensions)
+USAGE_ENABLED = os.getenv("OCR_USAGE_ENABLED", "1") != "0"
+
+USAGE_DIMENSIONS = ["type_document", "version_prompt", "backend", "modele"]
+USAGE_COUNTERS = [
+    "requetes",
+    "erreurs",
+    "prompt_tokens",
+    "image_tokens",
+    "cached_tokens",
+    "completion_tokens",
+    "payload_octets",
+    "temps_s",
+]
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS usage_cumul (
+    debut_s INTEGER NOT NULL,
+    {", ".join(f"{d} TEXT NOT NULL" for d in USAGE_DIMENSIONS)},
+    {", ".join(f"{c} {'REAL' if c == 'temps_s' else 'INTEGER'} NOT NULL DEFAULT 0" for c in USAGE_COUNTERS)},
+    PRIMARY KEY (debut_s, {", ".join(USAGE_DIMENSIONS)})
+)
+"""
+
+_UPSERT = f"""
+INSERT INTO usage_cumul (debut_s, {", ".join(USAGE_DIMENSIONS)}, {", ".join(USAGE_COUNTERS)})
+VALUES ({", ".join("?" for _ in range(1 + len(USAGE_DIMENSIONS) + len(USAGE_COUNTERS)))})
+ON CONFLICT (debut_s, {", ".join(USAGE_DIMENSIONS)}) DO UPDATE SET
+    {", ".join(f"{c} = {c} + excluded.{c}" for c in USAGE_COUNTERS)}
+"""
+
+
+# =========================
+# EXTRACTION
+# =========================
+
+def prompt_version(payload: Dict) -> str:
+    """
+    Version du prompt : empreinte courte du prompt système.
+    Toute modification d'un build_*_prompt() ouvre une nouvelle version.
+    """
+    system = [m.get("content") for m in payload.get("messages", []) if m.get("role") == "system"]
+    return hashlib.sha1(json.dumps(system, ensure_ascii=False).encode("utf-8")).hexdigest()[:12]
+
+
+def extract_usage(data: Optional[Dict]) -> Dict:
+    """
+    Lit le bloc `usage` d'une réponse /v1/chat/completions.
+    Les tokens image et en cache ne sont fournis que par certains backends
+    (usage.prompt_tokens_details) ; absents, ils valent 0.
+    """
+    usage = (data or {}).get("usage") or {}
+    details = usage.get("prompt_tokens_details") or {}
+
+    def as_int(value) -> int:
+        return int(value) if isinstance(value, (int, float)) else 0
+
+    return {
+        "prompt_tokens": as_int(usage.get("prompt_tokens")),
+        "completion_tokens": as_int(usage.get("completion_tokens")),
+        "image_tokens": as_int(details.get("image_tokens", usage.get("image_tokens"))),
+        "cached_tokens": as_int(details.get("cached_tokens")),
+    }
+
+
+# =========================
+# BASE DE CUMUL
+# =========================
+
+class UsageStore:
+    """
+    Cumul par tranche de USAGE_BUCKET_S secondes et par dimensions
+    (type de document, version de prompt, backend, modèle) : une requête
+    incrémente une ligne existante, la base reste petite quel que soit le trafic.
+    """
+
+    def __init__(self, path: str = USAGE_DB_PATH, bucket_s: int = USAGE_BUCKET_S):
+        self.path = path
+        self.bucket_s = max(1, bucket_s)
+        self._conn = None
+        self._lock = threading.Lock()
+
+    def _connection(self) -> sqlite3.Connection:
+        if self._conn is None:
+            if os.path.dirname(self.path):
+                os.makedirs(os.path.dirname(self.path), exist_ok=True)
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5.0)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(_SCHEMA)
+            conn.commit()
+            self._conn = conn
+        return self._conn
+
+    def record(self, dimensions: Dict, counters: Dict, at: Optional[float] = None) -> None:
+        bucket = int((at or time.time()) // self.bucket_s) * self.bucket_s
+        row = [bucket]
+        row += [str(dimensions.get(d) or "inconnu") for d in USAGE_DIMENSIONS]
+        row += [counters.get(c, 0) for c in USAGE_COUNTERS]
+        with self._lock:
+            conn = self._connection()
+            conn.execute(_UPSERT, row)
+            conn.commit()
+
+    def aggregate(self, since_s: float, until_s: float, group_by: List[str],
+                  step_s: Optional[int] = None) -> List[Dict]:
+        """
+        Sommes des compteurs sur [since_s, until_s[, groupées par `group_by`
+        (sous-ensemble de USAGE_DIMENSIONS) et, si `step_s` est fourni, par pas de
+        temps (colonne tranche_s : début de la tranche).
+        """
+        group_by = [d for d in group_by if d in USAGE_DIMENSIONS]
+        keys = list(group_by)
+        if step_s:
+            step_s = max(self.bucket_s, int(step_s))
+            # alias distinct de la colonne : GROUP BY debut_s viserait la colonne brute
+            keys = [f"(debut_s / {step_s}) * {step_s} AS tranche_s"] + keys
+
+        select = keys + [f"SUM({c}) AS {c}" for c in USAGE_COUNTERS]
+        sql = f"SELECT {', '.join(select)} FROM usage_cumul WHERE debut_s >= ? AND debut_s < ?"
+        group_cols = (["tranche_s"] if step_s else []) + group_by
+        if group_cols:
+            sql += f" GROUP BY {', '.join(group_cols)} ORDER BY {', '.join(group_cols)}"
+
+        with self._lock:
+            conn = self._connection()
+            cursor = conn.execute(sql, (int(since_s), int(until_s)))
+            columns = [c[0] for c in cursor.description]
+            rows = [dict(zip(columns, r)) for r in cursor.fetchall()]
+
+        return [_with_ratios(r) for r in rows if r["requetes"]]
+
+
+def _with_ratios(row: Dict) -> Dict:
+    n = row["requetes"]
+    row["temps_s"] = round(row["temps_s"], 3)
+    row["prompt_tokens_moyen"] = round(row["prompt_tokens"] / n, 1)
+    row["completion_tokens_moyen"] = round(row["completion_tokens"] / n, 1)
+    row["payload_octets_moyen"] = int(row["payload_octets"] / n)
+    row["temps_moyen_s"] = round(row["temps_s"] / n, 3)
+    row["taux_erreur"] = round(row["erreurs"] / n, 4)
+    return row
+
+
+USAGE_STORE = UsageStore()
+
+
+def record_usage(type_document: Optional[str], payload: Dict, backend: str, usage: Dict,
+                 payload_octets: int, temps_s: float, erreur: bool = False) -> None:
+    """
+    Enregistre une requête d'inférence. Un échec d'écriture ne doit jamais
+    faire échouer l'analyse : il est seulement signalé dans les logs.
+    """
+    if not USAGE_ENABLED:
+        return
+    try:
+        USAGE_STORE.record(
+            {
+                "type_document": type_document,
+                "version_prompt": prompt_version(payload),
+                "backend": backend,
+                "modele": payload.get("model"),
+            },
+            dict(usage, requetes=1, erreurs=int(erreur), payload_octets=payload_octets, temps_s=temps_s),
+        )
+    except sqlite3.Error as e:
+        print(f"### >>> Comptabilité d'usage indisponible : {e}  <<< ###")
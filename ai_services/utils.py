@@ -1,17 +1,21 @@
 import time
 import functools
 
+from ai_services.tracing import span
+
 
 def execution_timer(func):
     """
     Décorateur qui mesure et affiche le temps d'exécution d'une fonction
+    (et ouvre un span du même nom si la requête est tracée)
     """
 
     @functools.wraps(func)
     def wrapper(*args, **kwargs):
         start_time = time.perf_counter()  # plus précis que time.time()
 
-        result = func(*args, **kwargs)
+        with span(func.__name__):
+            result = func(*args, **kwargs)
 
         end_time = time.perf_counter()
         elapsed_time = end_time - start_time
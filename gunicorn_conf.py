@@ -0,0 +1,55 @@
+""" Configuration gunicorn du mode production : N workers uvicorn, application préchargée
+
+Usage :
+    gunicorn -c gunicorn_conf.py main:app
+
+Les workers partagent via SQLite (ai_services/shared_state.py) le budget
+d'inférence, les sessions CNI et les métriques : OCR_INFERENCE_CONCURRENCY
+borne alors les requêtes simultanées vers le backend pour l'ensemble des
+workers, et non plus par processus.
+
+Arrêt / rechargement : TERM (arrêt) ou HUP (remplacement des workers) laissent
+jusqu'à OCR_DRAIN_TIMEOUT_S secondes aux analyses en cours. Avec
+preload_app, HUP ne relit pas le code : pour déployer une nouvelle version
+sans coupure, USR2 (nouveau maître) puis QUIT sur l'ancien.
+"""
+import multiprocessing
+import os
+
+
+# =========================
+# WORKERS
+# =========================
+
+bind = os.getenv("OCR_BIND", "0.0.0.0:8000")
+workers = int(os.getenv("OCR_WORKERS", str(max(2, multiprocessing.cpu_count() // 2))))
+worker_class = "uvicorn.workers.UvicornWorker"
+preload_app = True                            # modèles de gabarits, imports lourds (numpy, pdfium) chargés une fois avant fork
+
+# Les requêtes OCR durent plusieurs dizaines de secondes : le délai de
+# drainage couvre au moins un appel LM Studio complet (LMSTUDIO_TIMEOUT = 120 s).
+graceful_timeout = int(os.getenv("OCR_DRAIN_TIMEOUT_S", "180"))
+timeout = graceful_timeout + 30
+keepalive = 5
+
+# =========================
+# ÉTAT PARTAGÉ
+# =========================
+
+# Lu à l'import de l'application (préchargée par le maître, donc après ce fichier)
+os.environ.setdefault("OCR_SHARED_STATE", "1")
+
+# Décodage / rendu : les cœurs sont répartis entre workers au lieu d'être tous revendiqués par chacun
+os.environ.setdefault("OCR_RENDER_CONCURRENCY", str(max(1, multiprocessing.cpu_count() // workers)))
+
+
+def on_starting(server):
+    from ai_services.shared_state import SHARED_STATE
+    SHARED_STATE.reset()
+
+
+def child_exit(server, worker):
+    # Worker terminé (normalement ou tué) : ses jauges (analyses en cours, jetons détenus) ne doivent pas rester affichées
+    # (ses jetons de budget, des verrous flock, sont rendus par le noyau)
+    from ai_services.shared_state import SHARED_STATE
+    SHARED_STATE.release_process(worker.pid)
@@ -1,11 +1,30 @@
+import asyncio
+from contextlib import asynccontextmanager
+
 from fastapi import FastAPI, Request
 from routes.ui import ocr_document_ui, home
 from starlette.exceptions import HTTPException as StarletteHTTPException
 from fastapi.responses import HTMLResponse
-from routes.api import ocr
+from routes.api import lifecycle, metrics, ocr, profiling
+from ai_services.lifecycle import DRAIN_TIMEOUT_S, INFLIGHT, install_drain_signal_handlers
+from routes.responses import compress_responses, mount_static, precompile_templates, render_template
+
+
+# --------------------------
+#  CYCLE DE VIE : DRAINAGE À L'ARRÊT / AU RECHARGEMENT
+# --------------------------
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    install_drain_signal_handlers()
+    yield
+    INFLIGHT.begin_drain()
+    remaining = await asyncio.to_thread(INFLIGHT.wait_drained, DRAIN_TIMEOUT_S)
+    if remaining:
+        print(f"### >>> Arrêt avec {remaining} analyse(s) encore en cours après {DRAIN_TIMEOUT_S}s  <<< ###")
 
 
 app = FastAPI(
+    lifespan=lifespan,
     title="API - IA Endpoint Creallia",
     description = """
         API-IA solution support pour une application d'analyse et de detections de transactions fauduleuses.
@@ -19,11 +38,30 @@ app = FastAPI(
 # --------------------------
 @app.exception_handler(404)
 async def not_found_page(request: Request, exc: StarletteHTTPException):
-    return home.templates.TemplateResponse(
-        "404.html",
-        {"request": request},
-        status_code=404
-    )
+    return render_template(request, "404.html", status_code=404)
+
+
+
+# --------------------------
+#  PROFILAGE À LA DEMANDE
+# --------------------------
+app.add_middleware(profiling.TraceRequestsMiddleware)
+
+
+
+# --------------------------
+#  ANALYSES EN COURS (drainage gracieux)
+# --------------------------
+app.middleware("http")(lifecycle.track_ocr_requests)
+
+
+
+# --------------------------
+#  COUCHE DE RÉPONSE (compression, gabarits, statiques)
+# --------------------------
+app.middleware("http")(compress_responses)
+precompile_templates()
+mount_static(app)
 
 
 
@@ -34,13 +72,18 @@ app.include_router(home.router)
 
 # API ENDPOINTS ############
 app.include_router(ocr.router)
+app.include_router(profiling.router)
+app.include_router(metrics.router)
+app.include_router(lifecycle.router)
 #############################
 
 
 
 
 if __name__ == "__main__":
+    # Mode développement (un seul processus, rechargement automatique).
+    # Production : gunicorn -c gunicorn_conf.py main:app
     import uvicorn
-    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True)
+    uvicorn.run("main:app", host="0.0.0.0", port=8000, reload=True, timeout_graceful_shutdown=DRAIN_TIMEOUT_S)
 
 
@@ -0,0 +1,59 @@
+""" Code des endpoint et middleware de cycle de vie des workers (drainage, santé) """
+import asyncio
+
+from fastapi import APIRouter, Request, status
+from fastapi.responses import JSONResponse
+
+from ai_services.lifecycle import DRAIN_TIMEOUT_S, INFLIGHT, workers_report
+
+router = APIRouter(
+    prefix="/ai-api",
+    tags=["Cycle de vie"]
+)
+
+
+# --------------------------
+#  MIDDLEWARE DE DRAINAGE
+# --------------------------
+async def track_ocr_requests(request: Request, call_next):
+    """
+    Compte les analyses (POST /ai-api/...) en cours. Pendant le drainage
+    d'un worker, elles sont refusées en 503 pour être rejouées sur un autre.
+    """
+    if request.method != "POST" or not request.url.path.startswith("/ai-api/"):
+        return await call_next(request)
+
+    if not INFLIGHT.enter():
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"detail": "Worker en cours d'arrêt, réessayer"},
+            headers={"Retry-After": "1", "Connection": "close"},
+        )
+    try:
+        return await call_next(request)
+    finally:
+        INFLIGHT.exit()
+
+
+# --------------------------
+#  SANTÉ ET WORKERS
+# --------------------------
+@router.get(
+    "/health",
+    summary="Disponibilité du worker (503 pendant le drainage, pour le répartiteur de charge)"
+)
+async def health():
+    if INFLIGHT.draining:
+        return JSONResponse(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            content={"statut": "drainage", "analyses_en_cours": INFLIGHT.count},
+        )
+    return {"statut": "ok", "analyses_en_cours": INFLIGHT.count, "delai_drainage_s": DRAIN_TIMEOUT_S}
+
+
+@router.get(
+    "/metrics/workers",
+    summary="Analyses en cours par worker et occupation du budget d'inférence commun"
+)
+async def get_workers_metrics():
+    return await asyncio.to_thread(workers_report)
@@ -0,0 +1,51 @@
+""" Code des endpoint d'exposition des métriques d'inférence """
+import asyncio
+import time
+from typing import Optional
+
+from fastapi import APIRouter, HTTPException, Query, status
+
+from ai_services.batching import batching_metrics
+from ai_services.usage import USAGE_DIMENSIONS, USAGE_STORE
+
+router = APIRouter(
+    prefix="/ai-api",
+    tags=["Métriques"]
+)
+
+
+@router.get(
+    "/metrics/batching",
+    summary="Efficacité du regroupement des appels d'inférence (taille des lots, préfixes partagés, attente)"
+)
+async def get_batching_metrics():
+    return await asyncio.to_thread(batching_metrics)
+
+
+@router.get(
+    "/metrics/usage",
+    summary="Consommation d'inférence (tokens, octets, temps) agrégée sur une fenêtre de temps"
+)
+async def get_usage_metrics(
+    fenetre_minutes: int = Query(60, ge=1, le=60 * 24 * 90),
+    group_by: str = Query("type_document", description=f"Dimensions séparées par des virgules parmi {USAGE_DIMENSIONS}"),
+    pas_s: Optional[int] = Query(None, ge=1, description="Pas de la série temporelle (aucun : un seul agrégat)"),
+):
+    dimensions = [d.strip() for d in group_by.split(",") if d.strip()]
+    unknown = [d for d in dimensions if d not in USAGE_DIMENSIONS]
+    if unknown:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Dimensions inconnues : {unknown} (attendues : {USAGE_DIMENSIONS})"
+        )
+
+    until_s = time.time()
+    since_s = until_s - 60 * fenetre_minutes
+    total = await asyncio.to_thread(USAGE_STORE.aggregate, since_s, until_s, [])
+    groupes = await asyncio.to_thread(USAGE_STORE.aggregate, since_s, until_s, dimensions, pas_s)
+    return {
+        "fenetre": {"debut_s": int(since_s), "fin_s": int(until_s), "granularite_s": USAGE_STORE.bucket_s},
+        "group_by": dimensions,
+        "total": (total or [None])[0],
+        "groupes": groupes,
+    }
@@ -1,52 +1,52 @@
 """ Code des endpoint en charge des uses case OCR """
+import asyncio
+from typing import List
+
 from fastapi import APIRouter, UploadFile, File, HTTPException, status, Form
-from ai_services.ocr.cni import analyse_cni_file
-from ai_services.ocr.passeport import analyse_passeport_file
+from ai_services.main import OcrProcessing, analyse_dossier
+from ai_services.sessions import SESSION_STORE, analyse_cni_session_file, build_session_result
+from ai_services.tracing import span
 from datetime import datetime
+import os
 
 router = APIRouter(
     prefix="/ai-api",
     tags=["OCR"]
 )
 
-LMSTUDIO_BASE_URL = "http://192.168.56.1:1234"
+LMSTUDIO_BASE_URL = os.getenv("LMSTUDIO_BASE_URL", "http://192.168.56.1:1234")
+
+SUPPORTED_CONTENT_TYPES = ["application/pdf", "image/jpeg", "image/png"]
 
 @router.post(
     "/ocr_document",
     summary="Endpoint en charge des opérations d'OCR ponctuel"
 )
-async def analyse(type_document: str = Form(...), file: UploadFile = File(...)):
+async def analyse(
+    type_document: str = Form(...),
+    file: UploadFile = File(...),
+    resolution_adaptative: bool = Form(True),
+    precompresse: bool = Form(False),
+):
     doc_type =  str(type_document.strip())
-    
+
     try:
         # Vérification du type de fichier
-        if file.content_type not in ["application/pdf", "image/jpeg", "image/png"]:
+        if file.content_type not in SUPPORTED_CONTENT_TYPES:
             raise HTTPException(
                 status_code=status.HTTP_400_BAD_REQUEST,
                 detail="Format non supporté"
             )
 
         # Lecture du fichier
-        file_bytes = await file.read()
-
-        if "Carte Nationale d'Identité" in  doc_type:
-            # Appel OCR
-            analyse_result = analyse_cni_file(
-                file_bytes=file_bytes,
-                filename = file.filename, 
-                pdf_scale = 2.0, 
-                lm_studio_url =  LMSTUDIO_BASE_URL
-            )
-
-        else :  
-            analyse_result =  analyse_passeport_file(
-                file_bytes=file_bytes,
-                filename=file.filename,
-                pdf_scale= 2.0,
-                lm_studio_url=LMSTUDIO_BASE_URL
-            )
-            
+        with span("lecture_upload"):
+            file_bytes = await file.read()
 
+        # Appel OCR hors de la boucle d'événements (analyse bloquante)
+        processing = OcrProcessing(
+            doc_type, file_bytes, file.filename, LMSTUDIO_BASE_URL, resolution_adaptative, precompresse
+        )
+        analyse_result = await asyncio.to_thread(processing.make_ocr)
 
         # Réponse OK
         return {
@@ -65,4 +65,155 @@ async def analyse(type_document: str = Form(...), file: UploadFile = File(...)):
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=f"Erreur interne lors de l'analyse OCR : {str(e)}"
         )
-    
\ No newline at end of file
+
+
+@router.post(
+    "/dossier",
+    summary="Analyse groupée de tous les documents d'un client avec contrôles de cohérence"
+)
+async def analyse_dossier_client(
+    types_documents: List[str] = Form(...),
+    files: List[UploadFile] = File(...),
+    resolution_adaptative: bool = Form(True),
+):
+    """
+    Un type de document par fichier, dans le même ordre
+    (ex : types_documents=["Carte Nationale d'Identité", "Passeport", "Permis de Conduire", "RCCM"]).
+    """
+    try:
+        if len(types_documents) != len(files):
+            raise HTTPException(
+                status_code=status.HTTP_400_BAD_REQUEST,
+                detail="Il faut exactement un type de document par fichier"
+            )
+
+        documents = []
+        with span("lecture_upload", fichiers=len(files)):
+            for doc_type, file in zip(types_documents, files):
+                if file.content_type not in SUPPORTED_CONTENT_TYPES:
+                    raise HTTPException(
+                        status_code=status.HTTP_400_BAD_REQUEST,
+                        detail=f"Format non supporté : {file.filename}"
+                    )
+                documents.append({
+                    "type_document": doc_type.strip(),
+                    "filename": file.filename,
+                    "file_bytes": await file.read(),
+                })
+
+        dossier = await asyncio.to_thread(
+            analyse_dossier, documents, LMSTUDIO_BASE_URL, resolution_adaptative
+        )
+
+        return {
+            "code": 200,
+            "message": "Analyse du dossier effectuée avec succès",
+            "dossier": dossier
+        }
+
+    except HTTPException:
+        raise
+
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erreur interne lors de l'analyse du dossier : {str(e)}"
+        )
+
+
+# --------------------------
+#  SESSIONS CNI (recto / verso envoyés séparément)
+# --------------------------
+async def _add_file_to_session(session_id: str, file: UploadFile, resolution_adaptative: bool,
+                               precompresse: bool):
+    if file.content_type not in SUPPORTED_CONTENT_TYPES:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Format non supporté"
+        )
+
+    with span("lecture_upload"):
+        file_bytes = await file.read()
+
+    try:
+        result = await asyncio.to_thread(
+            analyse_cni_session_file,
+            session_id, file_bytes, file.filename, LMSTUDIO_BASE_URL, resolution_adaptative, precompresse
+        )
+    except Exception as e:
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail=f"Erreur interne lors de l'analyse OCR : {str(e)}"
+        )
+
+    if result is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session introuvable ou expirée"
+        )
+    return {
+        "code": 200,
+        "message": "Page ajoutée à la session",
+        "model_response": result
+    }
+
+
+@router.post(
+    "/sessions/cni",
+    summary="Ouvre une session d'analyse CNI avec un premier fichier (recto, verso ou les deux)"
+)
+async def create_cni_session(
+    file: UploadFile = File(...),
+    resolution_adaptative: bool = Form(True),
+    precompresse: bool = Form(False),
+):
+    session_id = await asyncio.to_thread(SESSION_STORE.create, "Carte Nationale d'Identité")
+    try:
+        return await _add_file_to_session(session_id, file, resolution_adaptative, precompresse)
+    except HTTPException:
+        await asyncio.to_thread(SESSION_STORE.delete, session_id)
+        raise
+
+
+@router.post(
+    "/sessions/cni/{session_id}",
+    summary="Ajoute un fichier à une session CNI : seules les nouvelles pages sont analysées, puis fusionnées"
+)
+async def add_to_cni_session(
+    session_id: str,
+    file: UploadFile = File(...),
+    resolution_adaptative: bool = Form(True),
+    precompresse: bool = Form(False),
+):
+    return await _add_file_to_session(session_id, file, resolution_adaptative, precompresse)
+
+
+@router.get(
+    "/sessions/cni/{session_id}",
+    summary="Résultat fusionné courant d'une session CNI"
+)
+async def get_cni_session(session_id: str):
+    session = await asyncio.to_thread(SESSION_STORE.get, session_id)
+    if session is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session introuvable ou expirée"
+        )
+    return {
+        "code": 200,
+        "message": "Session CNI",
+        "model_response": build_session_result(session)
+    }
+
+
+@router.delete(
+    "/sessions/cni/{session_id}",
+    summary="Clôture une session CNI"
+)
+async def delete_cni_session(session_id: str):
+    if not await asyncio.to_thread(SESSION_STORE.delete, session_id):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Session introuvable ou expirée"
+        )
+    return {"code": 200, "message": "Session clôturée"}
@@ -0,0 +1,101 @@
+""" Code des endpoint de profilage à la demande (traces et profils CPU) """
+from fastapi import APIRouter, HTTPException, status
+from fastapi.responses import FileResponse
+from starlette.datastructures import Headers, MutableHeaders
+import asyncio
+import os
+
+from ai_services.tracing import (
+    TRACE_HEADER,
+    end_trace,
+    export_trace,
+    find_trace,
+    profile_path,
+    should_trace,
+    start_trace,
+)
+
+router = APIRouter(
+    prefix="/ai-api",
+    tags=["Profilage"]
+)
+
+
+# --------------------------
+#  MIDDLEWARE DE DÉCLENCHEMENT
+# --------------------------
+class TraceRequestsMiddleware:
+    """
+    Active une trace pour la requête si l'en-tête X-Ocr-Trace est présent
+    ("1" ou "profile") ou si la requête est tirée par l'échantillonnage.
+
+    Middleware ASGI pur : sans déclenchement, la requête est transmise telle
+    quelle (ni tâche supplémentaire, ni relecture du corps comme avec
+    BaseHTTPMiddleware). L'export de la trace se fait hors boucle d'événements.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        traced, profiled = should_trace(Headers(scope=scope).get(TRACE_HEADER))
+        if not traced:
+            return await self.app(scope, receive, send)
+
+        method, path = scope["method"], scope["path"]
+        token = start_trace(
+            f"{method} {path}",
+            profile=profiled,
+            **{"http.method": method, "http.target": path},
+        )
+        trace_id = token[0].trace_id
+
+        async def send_with_trace_headers(message):
+            if message["type"] == "http.response.start":
+                token[3].set_attribute("http.status_code", message["status"])
+                headers = MutableHeaders(scope=message)
+                headers["X-Ocr-Trace-Id"] = trace_id
+                if profiled:
+                    headers["X-Ocr-Profile-Url"] = f"/ai-api/profiling/{trace_id}/profile"
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace_headers)
+        except Exception as e:
+            await asyncio.to_thread(export_trace, end_trace(token, error=e))
+            raise
+        await asyncio.to_thread(export_trace, end_trace(token))
+
+
+# --------------------------
+#  TÉLÉCHARGEMENT
+# --------------------------
+@router.get(
+    "/profiling/{trace_id}",
+    summary="Trace (spans OTLP/JSON) d'une requête profilée"
+)
+async def get_trace(trace_id: str):
+    record = await asyncio.to_thread(find_trace, trace_id)
+    if record is None:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Trace introuvable"
+        )
+    return record
+
+
+@router.get(
+    "/profiling/{trace_id}/profile",
+    summary="Profil CPU échantillonné (format folded) d'une requête profilée"
+)
+async def get_profile(trace_id: str):
+    path = profile_path(os.path.basename(trace_id))
+    if not os.path.exists(path):
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail="Profil introuvable"
+        )
+    return FileResponse(path, media_type="text/plain", filename=f"{trace_id}.folded")
@@ -0,0 +1,270 @@
+""" Couche de réponse HTTP : gabarits pré-rendus, fichiers statiques cachables et compression """
+import gzip
+import hashlib
+import json
+import os
+import stat
+import threading
+from typing import Dict, Optional, Tuple
+
+from fastapi import Request
+from fastapi.responses import HTMLResponse, Response
+from fastapi.staticfiles import StaticFiles
+from fastapi.templating import Jinja2Templates
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse
+from starlette.staticfiles import NotModifiedResponse
+
+try:
+    import brotli
+except ImportError:                           # dépendance optionnelle : gzip seul
+    brotli = None
+
+
+# =========================
+# CONFIG
+# =========================
+
+TEMPLATES_DIR = "routes/ui/templates"
+STATIC_DIR = "routes/ui/static"
+
+TEMPLATES_RELOAD = os.getenv("OCR_TEMPLATES_RELOAD", "0") == "1"          # dev : relecture des gabarits à chaque requête
+STATIC_MAX_AGE_S = int(os.getenv("OCR_STATIC_MAX_AGE_S", str(7 * 24 * 3600)))
+COMPRESSION_MIN_BYTES = int(os.getenv("OCR_COMPRESSION_MIN_BYTES", "1024"))
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5                            # compromis débit / taux, adapté à des réponses dynamiques
+
+COMPRESSIBLE_TYPES = (
+    "text/html",
+    "application/json",
+    "text/css",
+    "application/javascript",
+    "text/javascript",
+    "image/svg+xml",
+)
+_COMPRESSED_CACHE_MAX = 256                   # variantes compressées gardées pour les réponses à ETag fort
+_STATIC_ETAGS_MAX = 1024                      # empreintes de fichiers statiques gardées en mémoire
+
+
+def _strong_etag(data: bytes) -> str:
+    return f'"{hashlib.sha256(data).hexdigest()[:32]}"'
+
+
+def etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """
+    Comparaison faible (RFC 9110) : une variante compressée porte la même
+    étiquette préfixée de W/ et doit aussi produire un 304.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    bare = etag.strip().removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in if_none_match.split(","))
+
+
+# --------------------------
+#  GABARITS PRÉ-COMPILÉS ET RENDUS EN CACHE
+# --------------------------
+templates = Jinja2Templates(directory=TEMPLATES_DIR)
+templates.env.auto_reload = TEMPLATES_RELOAD
+
+_rendered: Dict[Tuple[str, str], Tuple[bytes, str]] = {}
+_rendered_lock = threading.Lock()
+
+
+def precompile_templates() -> None:
+    """
+    Compile tous les gabarits au démarrage : la première requête ne paie plus la compilation Jinja.
+    """
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+def render_template(request: Request, name: str, context: Optional[Dict] = None,
+                    status_code: int = 200) -> Response:
+    """
+    Rend un gabarit une seule fois par contexte puis resert les octets en cache,
+    avec un ETag fort et revalidation (304 si le navigateur a déjà la page).
+
+    Réservé aux gabarits qui ne dépendent pas de la requête (pas de url_for,
+    pas de paramètres) : le contexte fourni suffit à identifier le rendu.
+    """
+    context = context or {}
+    key = (name, json.dumps(context, sort_keys=True, default=str))
+
+    cached = None if TEMPLATES_RELOAD else _rendered.get(key)
+    if cached is None:
+        body = templates.env.get_template(name).render({**context, "request": request}).encode("utf-8")
+        cached = (body, _strong_etag(body))
+        if not TEMPLATES_RELOAD:
+            with _rendered_lock:
+                _rendered[key] = cached
+
+    body, etag = cached
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if status_code == 200 and etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return HTMLResponse(body, status_code=status_code, headers=headers)
+
+
+# --------------------------
+#  FICHIERS STATIQUES
+# --------------------------
+class CachedStaticFiles(StaticFiles):
+    """
+    StaticFiles avec ETag fort calculé sur le contenu (et non sur la date de
+    modification, qui change à chaque déploiement) et durée de cache longue.
+
+    L'empreinte est calculée dans lookup_path, que Starlette exécute déjà hors
+    boucle d'événements : file_response ne fait plus que la relire en cache.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._etags: Dict[Tuple[str, int, int], str] = {}
+        self._etags_lock = threading.Lock()
+
+    def lookup_path(self, path: str):
+        full_path, stat_result = super().lookup_path(path)
+        if stat_result is not None and stat.S_ISREG(stat_result.st_mode):
+            self._etag(full_path, stat_result)
+        return full_path, stat_result
+
+    def _etag(self, full_path, stat_result: os.stat_result) -> str:
+        key = (str(full_path), stat_result.st_mtime_ns, stat_result.st_size)
+        etag = self._etags.get(key)
+        if etag is None:
+            digest = hashlib.sha256()
+            with open(full_path, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 16), b""):
+                    digest.update(chunk)
+            etag = f'"{digest.hexdigest()[:32]}"'
+            with self._etags_lock:
+                if len(self._etags) >= _STATIC_ETAGS_MAX:
+                    self._etags.clear()
+                self._etags[key] = etag
+        return etag
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        etag = self._etag(full_path, stat_result)       # déjà en cache sauf éviction entre-temps
+
+        headers = {"ETag": etag, "Cache-Control": f"public, max-age={STATIC_MAX_AGE_S}"}
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result, headers=headers)
+        if status_code == 200 and etag_matches(Headers(scope=scope).get("if-none-match"), etag):
+            return NotModifiedResponse(response.headers)
+        return response
+
+
+def mount_static(app) -> None:
+    """
+    Monte les fichiers statiques une seule fois, au niveau de l'application
+    (un Mount déclaré sur un APIRouter n'est pas repris par include_router).
+    """
+    if os.path.isdir(STATIC_DIR):
+        app.mount("/ui/static", CachedStaticFiles(directory=STATIC_DIR), name="static")
+    else:
+        print(f"### >>> Répertoire statique '{STATIC_DIR}' absent : /ui/static non monté  <<< ###")
+
+
+# --------------------------
+#  COMPRESSION
+# --------------------------
+_compressed: Dict[Tuple[str, str], bytes] = {}
+_compressed_lock = threading.Lock()
+
+
+def _accepted_encoding(accept_encoding: str) -> Optional[str]:
+    """
+    Codage retenu selon Accept-Encoding (RFC 9110) : le q le plus élevé parmi
+    les codages pris en charge (br si brotli est installé, gzip), `*` valant
+    pour ceux qui ne sont pas cités ; à égalité, br. None si aucun n'est accepté.
+    """
+    accepted = {}
+    for part in accept_encoding.lower().split(","):
+        token, _, params = part.strip().partition(";")
+        if not token.strip():
+            continue
+        q = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name == "q":
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        accepted[token.strip()] = q
+
+    supported = (["br"] if brotli is not None else []) + ["gzip"]
+    best, best_q = None, 0.0
+    for encoding in supported:
+        q = accepted.get(encoding, accepted.get("*", 0.0))
+        if q > best_q:
+            best, best_q = encoding, q
+    return best
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+
+async def compress_responses(request: Request, call_next):
+    """
+    Compresse (brotli sinon gzip) les réponses HTML / JSON / CSS / JS au-delà
+    de COMPRESSION_MIN_BYTES. Les réponses à ETag fort (gabarits, statiques)
+    gardent leur variante compressée en cache et reçoivent un ETag faible.
+    """
+    response = await call_next(request)
+
+    content_type = response.headers.get("content-type", "").split(";")[0].strip()
+    if (
+        request.method == "HEAD"
+        or response.status_code < 200 or response.status_code in (204, 304)
+        or content_type not in COMPRESSIBLE_TYPES
+        or "content-encoding" in response.headers
+    ):
+        return response
+
+    encoding = _accepted_encoding(request.headers.get("accept-encoding", ""))
+    length = response.headers.get("content-length")
+    if encoding is None or (length is not None and int(length) < COMPRESSION_MIN_BYTES):
+        response.headers.append("Vary", "Accept-Encoding")
+        return response
+
+    body = b"".join([chunk async for chunk in response.body_iterator])
+    if len(body) < COMPRESSION_MIN_BYTES:
+        return _rebuild(response, body, {"vary": "Accept-Encoding"})
+
+    etag = response.headers.get("etag")
+    if etag and not etag.startswith("W/"):
+        key = (etag, encoding)
+        compressed = _compressed.get(key)
+        if compressed is None:
+            compressed = _compress(body, encoding)
+            with _compressed_lock:
+                if len(_compressed) >= _COMPRESSED_CACHE_MAX:
+                    _compressed.clear()
+                _compressed[key] = compressed
+        etag = f"W/{etag}"
+    else:
+        compressed = _compress(body, encoding)
+
+    replaced = {"vary": "Accept-Encoding", "content-encoding": encoding}
+    if etag:
+        replaced["etag"] = etag
+    return _rebuild(response, compressed, replaced)
+
+
+def _rebuild(response: Response, body: bytes, replaced: Dict[str, str]) -> Response:
+    """
+    Nouvelle réponse avec le corps donné : en-têtes d'origine conservés
+    (y compris répétés, ex. set-cookie), sauf longueur et en-têtes remplacés.
+    """
+    dropped = {b"content-length"} | {k.encode("latin-1") for k in replaced}
+    rebuilt = Response(body, status_code=response.status_code)
+    rebuilt.raw_headers = [(k, v) for k, v in response.raw_headers if k.lower() not in dropped]
+    rebuilt.raw_headers += [(k.encode("latin-1"), v.encode("latin-1")) for k, v in replaced.items()]
+    rebuilt.raw_headers.append((b"content-length", str(len(body)).encode("latin-1")))
+    return rebuilt
@@ -0,0 +1,340 @@
+""" Générateur de charge en boucle ouverte pour /ai-api/ocr_document et rapport SLO
+
+Les arrivées suivent un processus de Poisson au débit demandé et sont
+planifiées à l'avance : elles n'attendent jamais les réponses (boucle
+ouverte). La latence est mesurée depuis l'instant planifié, de sorte qu'un
+retard côté client compte comme de la latence (pas d'omission coordonnée).
+
+Usage :
+    python -m tools.loadgen --url http://localhost:8000 \\
+        --rates 0.25,0.5,1,2 --duration 60 \\
+        --mix cni_image:0.5,cni_pdf:0.2,passport_image:0.2,passport_pdf:0.1 \\
+        --pdf-pages 1,2 --slo-p95 20 --output rapport_charge.json
+
+Cible un vrai backend d'inférence ou le stub local (tools/stub_lmstudio.py,
+API lancée avec LMSTUDIO_BASE_URL pointant dessus).
+"""
+import argparse
+import io
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import requests
+from PIL import Image, ImageDraw
+
+
+DOC_TYPES = {
+    "cni": "Carte Nationale d'Identité",
+    "passport": "Passeport",
+}
+
+CONTENT_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".pdf": "application/pdf",
+}
+
+
+# =========================
+# DOCUMENTS
+# =========================
+
+def _synthetic_page(width: int, height: int, seed: int) -> Image.Image:
+    """
+    Page synthétique ressemblant à un document (fond clair, zone photo, lignes de texte).
+    """
+    rng = random.Random(seed)
+    img = Image.new("RGB", (width, height), (232, 224, 205))
+    draw = ImageDraw.Draw(img)
+    draw.rectangle((40, 40, width // 4, height // 2), fill=(180, 170, 160))
+    for y in range(60, height - 60, 42):
+        x = width // 4 + 40
+        while x < width - 200:
+            draw.text((x, y), rng.choice(["NOM", "PRENOMS", "NE LE", "CI00", "12/03/1990"]), fill=(25, 25, 45))
+            x += rng.randint(90, 160)
+    return img
+
+
+def synthetic_document(kind: str, fmt: str, pages: int, seed: int) -> Tuple[str, bytes, str]:
+    """
+    Construit un document synthétique : retourne (nom_fichier, octets, content_type).
+    """
+    size = (1600, 1010) if kind == "cni" else (1400, 990)
+    imgs = [_synthetic_page(*size, seed=seed + i) for i in range(pages if fmt == "pdf" else 1)]
+    buf = io.BytesIO()
+    if fmt == "pdf":
+        imgs[0].save(buf, format="PDF", save_all=True, append_images=imgs[1:], resolution=150)
+        return f"{kind}_{pages}p.pdf", buf.getvalue(), "application/pdf"
+    imgs[0].save(buf, format="JPEG", quality=88)
+    return f"{kind}.jpg", buf.getvalue(), "image/jpeg"
+
+
+def load_samples(samples_dir: str) -> Dict[str, List[Tuple[str, bytes, str]]]:
+    """
+    Charge de vrais documents depuis un dossier. Le préfixe du nom de fichier
+    donne le type ("cni_*" ou "passport_*"), l'extension le format.
+    """
+    samples: Dict[str, List[Tuple[str, bytes, str]]] = {}
+    for name in sorted(os.listdir(samples_dir)):
+        kind = name.split("_", 1)[0].lower()
+        ext = os.path.splitext(name)[1].lower()
+        if kind not in DOC_TYPES or ext not in CONTENT_TYPES:
+            continue
+        fmt = "pdf" if ext == ".pdf" else "image"
+        with open(os.path.join(samples_dir, name), "rb") as f:
+            samples.setdefault(f"{kind}_{fmt}", []).append((name, f.read(), CONTENT_TYPES[ext]))
+    return samples
+
+
+def build_corpus(mix: Dict[str, float], pdf_pages: List[int], samples_dir: Optional[str]):
+    """
+    Corpus par catégorie du mélange ("cni_image", "passport_pdf", ...).
+    """
+    if samples_dir:
+        corpus = load_samples(samples_dir)
+        missing = [k for k in mix if k not in corpus]
+        if missing:
+            raise SystemExit(f"Aucun échantillon pour : {', '.join(missing)}")
+        return corpus
+
+    corpus = {}
+    for category in mix:
+        kind, fmt = category.split("_", 1)
+        counts = pdf_pages if fmt == "pdf" else [1]
+        corpus[category] = [synthetic_document(kind, fmt, n, seed=n) for n in counts]
+    return corpus
+
+
+def parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        category, weight = part.split(":")
+        kind, fmt = category.strip().split("_", 1)
+        if kind not in DOC_TYPES or fmt not in ("image", "pdf"):
+            raise argparse.ArgumentTypeError(f"Catégorie inconnue : {category}")
+        mix[category.strip()] = float(weight)
+    return mix
+
+
+# =========================
+# BOUCLE OUVERTE
+# =========================
+
+def _send(session: requests.Session, url: str, category: str, doc, timeout: float,
+          scheduled: float, results: List[Dict], lock: threading.Lock) -> None:
+    filename, data, content_type = doc
+    kind = category.split("_", 1)[0]
+    start = time.perf_counter()
+    record = {
+        "categorie": category,
+        "retard_envoi_s": start - scheduled,
+        "statut": None,
+        "erreur": None,
+    }
+    try:
+        resp = session.post(
+            url,
+            data={"type_document": DOC_TYPES[kind]},
+            files={"file": (filename, data, content_type)},
+            timeout=timeout,
+        )
+        record["statut"] = resp.status_code
+        if resp.status_code != 200:
+            record["erreur"] = "http"
+    except requests.Timeout:
+        record["erreur"] = "timeout"
+    except requests.RequestException:
+        record["erreur"] = "connexion"
+    end = time.perf_counter()
+
+    record["latence_s"] = end - scheduled
+    record["fin"] = end
+    with lock:
+        results.append(record)
+
+
+def run_step(url: str, rate: float, duration: float, mix: Dict[str, float], corpus, timeout: float,
+             max_inflight: int, rng: random.Random) -> Dict:
+    """
+    Exécute un palier à débit constant et retourne ses statistiques.
+    """
+    results: List[Dict] = []
+    lock = threading.Lock()
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_connections=max_inflight, pool_maxsize=max_inflight)
+    session.mount("http://", adapter)
+    session.mount("https://", adapter)
+
+    categories = list(mix)
+    weights = [mix[c] for c in categories]
+
+    # Planification des arrivées (Poisson) indépendante des réponses
+    arrivals = []
+    t = rng.expovariate(rate)
+    while t < duration:
+        category = rng.choices(categories, weights)[0]
+        arrivals.append((t, category, rng.choice(corpus[category])))
+        t += rng.expovariate(rate)
+
+    with ThreadPoolExecutor(max_workers=max_inflight) as pool:
+        t0 = time.perf_counter()
+        for offset, category, doc in arrivals:
+            delay = t0 + offset - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            pool.submit(_send, session, url, category, doc, timeout, t0 + offset, results, lock)
+    session.close()
+
+    return summarize_step(rate, duration, t0, results)
+
+
+def _percentile(values: List[float], q: float) -> Optional[float]:
+    if not values:
+        return None
+    ordered = sorted(values)
+    k = min(len(ordered) - 1, max(0, int(round(q / 100 * (len(ordered) - 1)))))
+    return round(ordered[k], 3)
+
+
+def summarize_step(rate: float, duration: float, t0: float, results: List[Dict]) -> Dict:
+    ok = [r for r in results if r["erreur"] is None]
+    latencies = [r["latence_s"] for r in ok]
+    total = len(results)
+    # Débit atteint : succès rapportés à la durée réelle, drainage compris
+    last_end = max((r["fin"] for r in results), default=t0)
+
+    by_category: Dict[str, Dict] = {}
+    for r in results:
+        c = by_category.setdefault(r["categorie"], {"requetes": 0, "erreurs": 0, "latences": []})
+        c["requetes"] += 1
+        if r["erreur"] is None:
+            c["latences"].append(r["latence_s"])
+        else:
+            c["erreurs"] += 1
+    for c in by_category.values():
+        lat = c.pop("latences")
+        c["p50_s"] = _percentile(lat, 50)
+        c["p95_s"] = _percentile(lat, 95)
+
+    return {
+        "debit_offert_rps": rate,
+        "duree_s": duration,
+        "requetes": total,
+        "succes": len(ok),
+        "debit_atteint_rps": round(len(ok) / max(last_end - t0, duration), 4),
+        "latence_s": {
+            "p50": _percentile(latencies, 50),
+            "p90": _percentile(latencies, 90),
+            "p95": _percentile(latencies, 95),
+            "p99": _percentile(latencies, 99),
+            "max": round(max(latencies), 3) if latencies else None,
+        },
+        "taux_erreur": round(sum(1 for r in results if r["erreur"] in ("http", "connexion")) / total, 4) if total else 0.0,
+        "taux_timeout": round(sum(1 for r in results if r["erreur"] == "timeout") / total, 4) if total else 0.0,
+        "retard_envoi_max_s": round(max((r["retard_envoi_s"] for r in results), default=0.0), 3),
+        "par_categorie": by_category,
+    }
+
+
+def find_knee(steps: List[Dict], slo_p95: float, max_error_rate: float) -> Dict:
+    """
+    Genou de saturation : dernier palier qui respecte le SLO avant le premier
+    palier où le débit atteint décroche (< 90 % de l'offert), où le p95 dépasse
+    le SLO ou où le taux d'erreur/timeout dépasse le seuil.
+    """
+    last_ok = None
+    for step in steps:
+        reasons = []
+        if step["debit_atteint_rps"] < 0.9 * step["debit_offert_rps"]:
+            reasons.append("debit")
+        p95 = step["latence_s"]["p95"]
+        if p95 is None or p95 > slo_p95:
+            reasons.append("latence_p95")
+        if step["taux_erreur"] + step["taux_timeout"] > max_error_rate:
+            reasons.append("erreurs")
+        if reasons:
+            return {
+                "debit_max_soutenable_rps": last_ok["debit_offert_rps"] if last_ok else None,
+                "premier_palier_sature_rps": step["debit_offert_rps"],
+                "criteres": reasons,
+            }
+        last_ok = step
+
+    return {
+        "debit_max_soutenable_rps": last_ok["debit_offert_rps"] if last_ok else None,
+        "premier_palier_sature_rps": None,
+        "criteres": [],
+    }
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], text=True, stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test de charge en boucle ouverte de /ai-api/ocr_document")
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--rates", default="0.25,0.5,1,2", help="débits par palier (req/s), séparés par des virgules")
+    parser.add_argument("--duration", type=float, default=60.0, help="durée de chaque palier (s)")
+    parser.add_argument("--mix", type=parse_mix, default=parse_mix("cni_image:0.5,cni_pdf:0.2,passport_image:0.2,passport_pdf:0.1"))
+    parser.add_argument("--pdf-pages", default="1,2", help="nombres de pages des PDF synthétiques")
+    parser.add_argument("--samples", default=None, help="dossier de vrais documents (cni_*.jpg, passport_*.pdf, ...)")
+    parser.add_argument("--timeout", type=float, default=180.0)
+    parser.add_argument("--max-inflight", type=int, default=256, help="requêtes simultanées max côté client")
+    parser.add_argument("--slo-p95", type=float, default=20.0, help="SLO de latence p95 (s)")
+    parser.add_argument("--max-error-rate", type=float, default=0.01)
+    parser.add_argument("--label", default=None, help="étiquette de version à inscrire dans le rapport")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--output", default="rapport_charge.json")
+    args = parser.parse_args()
+
+    rates = [float(r) for r in args.rates.split(",")]
+    pdf_pages = [int(n) for n in args.pdf_pages.split(",")]
+    corpus = build_corpus(args.mix, pdf_pages, args.samples)
+    endpoint = f"{args.url.rstrip('/')}/ai-api/ocr_document"
+    rng = random.Random(args.seed)
+
+    steps = []
+    for rate in rates:
+        print(f"### >>> Palier {rate} req/s pendant {args.duration:.0f} s  <<< ###")
+        step = run_step(endpoint, rate, args.duration, args.mix, corpus, args.timeout, args.max_inflight, rng)
+        print(json.dumps({k: step[k] for k in ("debit_atteint_rps", "latence_s", "taux_erreur", "taux_timeout")}))
+        steps.append(step)
+
+    report = {
+        "version": args.label or _git_revision(),
+        "date": datetime.now().isoformat(timespec="seconds"),
+        "cible": endpoint,
+        "config": {
+            "debits_rps": rates,
+            "duree_palier_s": args.duration,
+            "melange": args.mix,
+            "pages_pdf": pdf_pages,
+            "echantillons": args.samples,
+            "timeout_s": args.timeout,
+            "slo_p95_s": args.slo_p95,
+            "taux_erreur_max": args.max_error_rate,
+            "seed": args.seed,
+        },
+        "paliers": steps,
+        "genou_saturation": find_knee(steps, args.slo_p95, args.max_error_rate),
+    }
+
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"### >>> Rapport écrit dans {args.output} : {report['genou_saturation']}  <<< ###")
+
+
+if __name__ == "__main__":
+    main()
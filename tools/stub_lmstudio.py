@@ -0,0 +1,178 @@
+""" Serveur factice compatible LM Studio (/v1/chat/completions) pour les tests de charge
+
+Usage :
+    python -m tools.stub_lmstudio --port 1234 --slots 2 --latency 1.5
+
+puis lancer l'API avec LMSTUDIO_BASE_URL=http://127.0.0.1:1234
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+CNI_RECTO = {
+    "face": "recto",
+    "numero_cni": "CI002658965",
+    "nom": "KOUASSI",
+    "prenoms": "AYA MARIE",
+    "date_naissance": "12/03/1990",
+    "nationalite": "IVOIRIENNE",
+    "date_expiration": "11/05/2030",
+    "nni": None,
+    "profession": None,
+    "date_emission": None,
+}
+
+CNI_VERSO = {
+    "face": "verso",
+    "numero_cni": None,
+    "nom": None,
+    "prenoms": None,
+    "date_naissance": None,
+    "nationalite": None,
+    "date_expiration": None,
+    "nni": "12121245896",
+    "profession": "COMMERCANTE",
+    "date_emission": "12/05/2020",
+}
+
+PASSPORT = {
+    "analyse_securite": {
+        "document_complet": True,
+        "authenticite_probable": "oui",
+        "points_de_controle": {
+            "mrz_presente": True,
+            "image_fantome_visible": True,
+            "logos_conformes": True,
+            "dates_coherentes": True,
+        },
+        "alertes": [],
+    },
+    "donnees_titulaire": {
+        "nom": "KOUASSI",
+        "prenoms": "AYA MARIE",
+        "date_naissance": "12/03/1990",
+        "lieu_naissance": "ABIDJAN",
+        "sexe": "F",
+        "nationalite": "IVOIRIENNE",
+        "profession": "COMMERCANTE",
+    },
+    "donnees_document": {
+        "passeport_no": "20AB12345",
+        "type": "P",
+        "code_pays": "CIV",
+        "date_emission": "01/02/2021",
+        "date_expiration": "31/01/2026",
+    },
+}
+
+
+class StubConfig:
+    latency = 1.5            # s, temps de "prefill + génération" de base
+    latency_per_kb = 0.002   # s par Ko de payload (coût image)
+    jitter = 0.2             # fraction aléatoire +/- sur la latence
+    missing_rate = 0.0       # part de réponses avec champs manquants (déclenche l'escalade)
+    error_rate = 0.0         # part de réponses HTTP 500
+    slots = None             # threading.BoundedSemaphore : parallélisme du "GPU"
+
+
+def _choose_content(system_prompt: str):
+    if "passeport" in system_prompt.lower():
+        content = json.loads(json.dumps(PASSPORT))
+        if random.random() < StubConfig.missing_rate:
+            content["donnees_document"]["passeport_no"] = None
+        return content
+
+    content = dict(random.choice([CNI_RECTO, CNI_VERSO]))
+    if random.random() < StubConfig.missing_rate:
+        content["date_naissance" if content["face"] == "recto" else "nni"] = None
+    return content
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, code: int, body) -> None:
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        if self.path != "/v1/chat/completions":
+            self._send_json(404, {"error": "not found"})
+            return
+
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length)
+        payload = json.loads(raw or b"{}")
+        messages = payload.get("messages") or [{}]
+        system_prompt = messages[0].get("content") or ""
+
+        delay = StubConfig.latency + StubConfig.latency_per_kb * (len(raw) / 1024)
+        delay *= 1 + random.uniform(-StubConfig.jitter, StubConfig.jitter)
+
+        with StubConfig.slots:
+            time.sleep(max(0.0, delay))
+
+        if random.random() < StubConfig.error_rate:
+            self._send_json(500, {"error": "stub: erreur simulée"})
+            return
+
+        content = _choose_content(system_prompt)
+        self._send_json(200, {
+            "id": "stub",
+            "object": "chat.completion",
+            "model": payload.get("model"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": json.dumps(content, ensure_ascii=False)},
+                "finish_reason": "stop",
+            }],
+            "usage": {
+                "prompt_tokens": len(system_prompt) // 4 + len(raw) // 1500,
+                "completion_tokens": 120,
+                "total_tokens": len(system_prompt) // 4 + len(raw) // 1500 + 120,
+            },
+        })
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serveur LM Studio factice pour les tests de charge")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=1234)
+    parser.add_argument("--slots", type=int, default=2, help="requêtes traitées en parallèle")
+    parser.add_argument("--latency", type=float, default=StubConfig.latency)
+    parser.add_argument("--latency-per-kb", type=float, default=StubConfig.latency_per_kb)
+    parser.add_argument("--jitter", type=float, default=StubConfig.jitter)
+    parser.add_argument("--missing-rate", type=float, default=StubConfig.missing_rate)
+    parser.add_argument("--error-rate", type=float, default=StubConfig.error_rate)
+    args = parser.parse_args()
+
+    StubConfig.latency = args.latency
+    StubConfig.latency_per_kb = args.latency_per_kb
+    StubConfig.jitter = args.jitter
+    StubConfig.missing_rate = args.missing_rate
+    StubConfig.error_rate = args.error_rate
+    StubConfig.slots = threading.BoundedSemaphore(args.slots)
+
+    server = ThreadingHTTPServer((args.host, args.port), StubHandler)
+    print(f"### >>> Stub LM Studio sur http://{args.host}:{args.port} ({args.slots} slots)  <<< ###")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()